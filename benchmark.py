@@ -0,0 +1,406 @@
+"""
+Benchmark of the functions in 'functions.py' on synthetic datasets shaped like NationalNames.csv and StateNames.csv.
+
+The datasets are generated from a seed at 1x, 10x or 100x the row counts of the real Kaggle files (see 'generate_synthetic_datasets'),
+every benchmark case is timed and its peak memory is measured, and the results are written to a JSON report with sorted keys,
+so the reports of two commits can be compared line by line, or with 'python benchmark.py --compare old.json new.json'.
+
+Usage:
+python benchmark.py                                  - 1x datasets, report in benchmark_report.json
+python benchmark.py --scales 1 10 100 --repeat 3     - all scales, the best of 3 runs of every case
+python benchmark.py --scaling 1 2 4 8                - also measures the state work on 1, 2, 4 and 8 processes against the serial run
+python benchmark.py --compare old.json new.json      - prints the relative change of every case
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import matplotlib
+import matplotlib.pyplot as plt
+import plotly
+import plotly.graph_objects as go
+import functions
+
+REPORT_FORMAT = 1 # part of every report, increased when the meaning of the measured values changes
+SYNTHETIC_FORMAT = 1 # part of the description of every generated dataset, increasing it regenerates the datasets
+
+NATIONAL_ROWS = 1825433 # rows of the real NationalNames.csv
+STATE_ROWS = 5647426 # rows of the real StateNames.csv
+NATIONAL_YEARS = (1880, 2014)
+STATE_YEARS = (1910, 2014)
+STATES = ["AK", "AL", "AR", "AZ", "CA", "CO", "CT", "DC", "DE", "FL", "GA", "HI", "IA", "ID", "IL", "IN", "KS", "KY", "LA", "MA", "MD", "ME", "MI", "MN", "MO", "MS", "MT",
+          "NC", "ND", "NE", "NH", "NJ", "NM", "NV", "NY", "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VA", "VT", "WA", "WI", "WV", "WY"]
+
+NAMES_PER_SCALE = 100000 # size of the name vocabulary at 1x, the real NationalNames dataset has ~ 94 000 names
+ZIPF_EXPONENT = 1.1 # popularity of the name of rank r is proportional to r^-ZIPF_EXPONENT, roughly the skew of the real data
+PEAK_COUNT = 80000 # yearly count of the most popular name nationally in the last year, the real maximum is ~ 99 000
+MINIMUM_COUNT = 5 # the real datasets leave out names given less than 5 times
+
+def _synthetic_names(number_of_names, rng):
+    """
+    This function makes number_of_names distinct pronounceable names from 2 letter syllables, e.g. 'Kalimo', in a random order.
+    """
+    syllables = np.array([consonant + vowel for consonant in "bdfghjklmnprstvz" for vowel in "aeiou"], dtype=object)
+    values = np.arange(number_of_names) + len(syllables) # every name has at least 2 syllables
+    names = np.full(number_of_names, "", dtype=object)
+    while values.any():
+        names = np.where(values > 0, syllables[values % len(syllables)] + names, names)
+        values //= len(syllables)
+    names = np.char.capitalize(names.astype(str)).astype(object)
+    return names[rng.permutation(number_of_names)] # the popularity follows the position, so the alphabetical order is not the popularity order
+
+def _year_weights(first_year, last_year):
+    years = np.arange(first_year, last_year + 1)
+    rows = np.exp((years - first_year) / 40) # the number of distinct names recorded per year grows over time, like in the real data
+    births = 0.15 + 0.85 * (years - first_year) / (last_year - first_year)
+    return years, rows / rows.sum(), births
+
+def _sample_group(rng, gender_weights, gender_order, number_of_rows, count_scale):
+    """
+    This function draws the rows of one (year, gender) or (year, state, gender) group: number_of_rows distinct names, more popular ones more likely,
+    and their counts, sorted by the count descending as in the real files.
+    The names are drawn without replacement (Efraimidis-Spirakis) from the 3 * number_of_rows names most popular for the gender.
+    """
+    pool = gender_order[:min(len(gender_order), 3 * number_of_rows)]
+    number_of_rows = min(number_of_rows, len(pool))
+    keys = rng.exponential(size=len(pool)) / gender_weights[pool]
+    chosen = pool[np.argpartition(keys, number_of_rows - 1)[:number_of_rows]]
+    counts = MINIMUM_COUNT + np.floor(count_scale * gender_weights[chosen] * rng.lognormal(0, 0.4, size=number_of_rows)).astype(np.int64)
+    order = np.argsort(-counts, kind="stable")
+    return chosen[order], counts[order]
+
+def generate_synthetic_datasets(output_dir, scale=1, seed=0):
+    """
+    This function writes NationalNames.csv and StateNames.csv with the columns of the real files and about 'scale' times their numbers of rows.
+    The same seed and scale always give the same files. Files already generated with the same seed and scale are reused.
+
+    The data imitate the real ones where it matters for the analysis functions:
+    - a vocabulary of NAMES_PER_SCALE * scale names with Zipf-distributed popularity (a few very common names, a long tail of rare ones)
+    - every name has its own share of girls (mostly close to 0 or 1, so only some names are unisex)
+    - the number of distinct names per year grows over time, states differ in size, no row has a count below 5
+
+    Parameters:
+    output_dir - folder for the two CSV files and the description 'synthetic.json'
+    scale - multiple of the real row counts, e.g. 1, 10 or 100 (at 100x the files take ~ 20 GB)
+    seed - seed of the random generator
+
+    Returns the description of the generated datasets: paths, seed, scale and the numbers of rows.
+    """
+    description_path = os.path.join(output_dir, "synthetic.json")
+    if os.path.isfile(description_path):
+        with open(description_path) as file:
+            description = json.load(file)
+        if (description["format"], description["seed"], description["scale"]) == (SYNTHETIC_FORMAT, seed, scale) and all(os.path.isfile(description[key]) for key in ("national", "state")):
+            return description
+        os.remove(description_path) # written last, so a missing description means the files are incomplete
+
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng([seed, int(scale * 1000)])
+    number_of_names = int(NAMES_PER_SCALE * scale)
+    names = _synthetic_names(number_of_names, rng)
+    popularity = (np.arange(number_of_names) + 1.0) ** -ZIPF_EXPONENT
+    female_share = rng.beta(0.2, 0.2, size=number_of_names)
+    gender_weights = {"F": popularity * female_share, "M": popularity * (1 - female_share)}
+    gender_orders = {gender: np.argsort(-weights, kind="stable") for gender, weights in gender_weights.items()}
+    state_shares = rng.lognormal(0, 1, size=len(STATES))
+    state_shares /= state_shares.sum()
+
+    description = {"format": SYNTHETIC_FORMAT, "seed": seed, "scale": scale,
+                   "national": os.path.join(output_dir, "NationalNames.csv"), "state": os.path.join(output_dir, "StateNames.csv")}
+
+    rows_written = 0
+    years, year_shares, births = _year_weights(*NATIONAL_YEARS)
+    with open(description["national"], "w", newline="") as file:
+        for year, year_share, birth in zip(years, year_shares, births):
+            parts = []
+            for gender in ("F", "M"):
+                number_of_rows = max(1, round(NATIONAL_ROWS * scale * year_share / 2))
+                chosen, counts = _sample_group(rng, gender_weights[gender], gender_orders[gender], number_of_rows, PEAK_COUNT * birth)
+                parts.append(pd.DataFrame({"Name": names[chosen], "Year": year, "Gender": gender, "Count": counts}))
+            year_rows = pd.concat(parts, ignore_index=True)
+            year_rows.insert(0, "Id", np.arange(rows_written + 1, rows_written + len(year_rows) + 1))
+            year_rows.to_csv(file, header=rows_written == 0, index=False)
+            rows_written += len(year_rows)
+    description["national_rows"] = rows_written
+
+    rows_written = 0
+    years, year_shares, births = _year_weights(*STATE_YEARS)
+    with open(description["state"], "w", newline="") as file:
+        for year, year_share, birth in zip(years, year_shares, births):
+            parts = []
+            for state, state_share in zip(STATES, state_shares):
+                for gender in ("F", "M"):
+                    number_of_rows = max(1, round(STATE_ROWS * scale * year_share * state_share / 2))
+                    chosen, counts = _sample_group(rng, gender_weights[gender], gender_orders[gender], number_of_rows, PEAK_COUNT * birth * state_share)
+                    parts.append(pd.DataFrame({"Name": names[chosen], "Year": year, "Gender": gender, "State": state, "Count": counts}))
+            year_rows = pd.concat(parts, ignore_index=True)
+            year_rows.insert(0, "Id", np.arange(rows_written + 1, rows_written + len(year_rows) + 1))
+            year_rows.to_csv(file, header=rows_written == 0, index=False)
+            rows_written += len(year_rows)
+    description["state_rows"] = rows_written
+
+    with open(description_path, "w") as file:
+        json.dump(description, file, indent=2, sort_keys=True)
+    return description
+
+@contextlib.contextmanager
+def _headless_plotly():
+    """
+    'plot_top_names_by_state' ends with fig.show(), which needs a browser or a notebook.
+    Here the figure is only serialized to JSON, the work every plotly renderer does, so the case measures building the map and not displaying it.
+    """
+    show = go.Figure.show
+    go.Figure.show = lambda figure, *args, **kwargs: figure.to_json()
+    try:
+        yield
+    finally:
+        go.Figure.show = show
+
+def _measure(setup, run, repeat, measure_memory):
+    """
+    This function measures one benchmark case. Before every run, all in-memory caches of 'functions.py' are cleared and setup() is called (not measured),
+    then run(prepared) is timed, where prepared is the value returned by setup.
+    Returns the best and all wall times in seconds and, if measure_memory is True, the peak memory in MB from one extra run under tracemalloc
+    (the peak of the memory allocated by Python and NumPy during the run, memory-mapped cache files and memory of worker processes are not included).
+    """
+    def prepare():
+        functions.clear_memory_caches()
+        gc.collect()
+        return setup()
+
+    seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            prepared = prepare()
+            start = time.perf_counter()
+            run(prepared)
+            seconds.append(time.perf_counter() - start)
+            del prepared
+
+        result = {"seconds": min(seconds), "seconds_all": seconds}
+        if measure_memory:
+            prepared = prepare()
+            tracemalloc.start()
+            try:
+                run(prepared)
+                result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            finally:
+                tracemalloc.stop()
+    return result
+
+def _benchmark_cases(national, state, results_dir, top_names, processes):
+    """
+    This function lists the benchmark cases of one pair of datasets as (kind, name, setup, run) tuples.
+    The kind 'stage' measures the stages of the analysis separately (load, aggregate, fit, render) from prepared inputs,
+    the kind 'function' measures the public functions of 'functions.py' end to end, starting from the dataset caches on disk as main.py does in its later runs.
+    """
+    def cold_cache(path):
+        return lambda: shutil.rmtree(functions.dataset_cache_dir(path), ignore_errors=True)
+
+    def loaded(path):
+        return lambda: functions.load_dataset(path)
+
+    def last_years(years_to_analyze):
+        def setup():
+            [name_year_totals] = functions.aggregate_counts(national, [["Name", "Year"]])
+            name_year_counts = name_year_totals.reset_index()
+            return name_year_counts[name_year_counts["Year"] > name_year_counts["Year"].max() - years_to_analyze].reset_index(drop=True)
+        return setup
+
+    def trending(years_to_analyze):
+        def setup():
+            name_year_counts = last_years(years_to_analyze)()
+            trends = functions.fit_name_trends(name_year_counts)
+            return name_year_counts, trends.sort_values(by="Trend_Slope", ascending=False).head(10)
+        return setup
+
+    def name_histograms():
+        name_index = functions.load_name_index(national)
+        return [(functions.plot_name_count_per_year, {"name_count_per_year": name_index.series(name),
+                                                       "title": f"Occurrences of the name {name} over the years",
+                                                       "save_path": os.path.join(results_dir, f"{name}_change_over_time_national.png")})
+                for name in top_names[:10]]
+
+    nothing = lambda: None
+    stages = [
+        ("load", "load_dataset NationalNames from CSV", cold_cache(national), lambda _: functions.load_dataset(national)),
+        ("load", "load_dataset NationalNames from cache", nothing, lambda _: functions.load_dataset(national)),
+        ("load", "load_dataset StateNames from CSV", cold_cache(state), lambda _: functions.load_dataset(state)),
+        ("load", "load_dataset StateNames from cache", nothing, lambda _: functions.load_dataset(state)),
+        ("aggregate", "aggregate_counts NationalNames Name, Name+Gender, Name+Year", loaded(national),
+         lambda df: functions.aggregate_counts(df, [["Name"], ["Name", "Gender"], ["Name", "Year"]])),
+        ("aggregate", "aggregate_counts StateNames State+Name, State, Name+Gender", loaded(state),
+         lambda df: functions.aggregate_counts(df, [["State", "Name"], ["State"], ["Name", "Gender"]], processes=processes)),
+        ("aggregate", "aggregate_counts StateNames State+Name streamed from CSV", nothing,
+         lambda _: functions.aggregate_counts(state, [["State", "Name"]], chunk_size=1000000)),
+        ("aggregate", "load_name_index NationalNames", loaded(national), lambda df: functions.load_name_index(df)),
+        ("aggregate", "load_name_index StateNames by state", loaded(state), lambda df: functions.load_name_index(df, by_state=True)),
+        ("fit", "fit_name_trends last 20 years", last_years(20), functions.fit_name_trends),
+        ("fit", "fit_name_trends all years", last_years(NATIONAL_YEARS[1] - NATIONAL_YEARS[0] + 1), functions.fit_name_trends),
+        ("fit", "RollingTrendScanner top 10 of 3, 10 and 20 year windows", lambda: functions.load_name_index(national),
+         lambda name_index: functions.RollingTrendScanner(name_index).top_trending([3, 10, 20])),
+        ("render", "render_plots 10 name histograms", name_histograms, lambda jobs: functions.render_plots(jobs, processes)),
+        ("render", "plot_trending_names top 10", trending(3),
+         lambda prepared: functions.plot_trending_names(prepared[0], prepared[1], 3, results_dir, "trending_analysis", processes)),
+    ]
+
+    function_cases = [
+        ("check_year_span", lambda: functions.check_year_span(national, "NationalNames")),
+        ("average_occurrence_in_time_period_national", lambda: functions.average_occurrence_in_time_period_national(national, top_names[0], 1910, 1930)),
+        ("average_occurrence_in_time_period_national_batch 1000 names", lambda: functions.average_occurrence_in_time_period_national_batch(national, top_names[:1000], 1910, 1930)),
+        ("plot_name_occurance_change_over_time National",
+         lambda: functions.plot_name_occurance_change_over_time(national, state, top_names[0], "National", None, results_dir, "name_change_over_time_national")),
+        ("plot_name_occurance_change_over_time State CA",
+         lambda: functions.plot_name_occurance_change_over_time(national, state, top_names[0], "State", "CA", results_dir, "name_change_over_time_state_CA")),
+        ("plot_name_occurance_change_over_time_batch 10 names",
+         lambda: functions.plot_name_occurance_change_over_time_batch(national, state, top_names[:10], "National", None, results_dir, "{name}_change_over_time_batch", processes)),
+        ("random_most_unisex_name", lambda: functions.random_most_unisex_name(national, state, "National", 0.8, 1000, True)),
+        ("find_common_national_rare_state", lambda: functions.find_common_national_rare_state(national, state, 0.75, 0.65, "State", True, processes=processes)),
+        ("find_trending_names_by_slope", lambda: functions.find_trending_names_by_slope(national, 3, 10, results_dir, "trending_analysis", processes)),
+        ("top_10_states_most_newborns", lambda: functions.top_10_states_most_newborns(state, 10, processes=processes)),
+        ("plot_top_names_by_state", lambda: functions.plot_top_names_by_state(state, processes=processes)),
+        ("plot_top_names_by_state_per_period decade", lambda: functions.plot_top_names_by_state_per_period(state, "decade", results_dir, render_processes=processes, processes=processes)),
+    ]
+
+    cases = [("stage", f"{stage}/{name}", setup, run) for stage, name, setup, run in stages]
+    cases += [("function", name, nothing, lambda _, function=function: function()) for name, function in function_cases]
+    return cases
+
+def _scaling_cases(national, state):
+    """
+    This function lists the cases of the scaling measurement as (name, run) tuples, run(processes) runs the case serially for None.
+    They are the functions whose per-state work runs on the processes of '_map_states'.
+    """
+    state_groupings = [["State", "Name"], ["State"], ["Name", "Gender"]]
+    return [
+        ("aggregate_counts StateNames State+Name, State, Name+Gender", lambda processes: functions.aggregate_counts(state, state_groupings, processes=processes)),
+        ("find_common_national_rare_state", lambda processes: functions.find_common_national_rare_state(national, state, 0.75, 0.65, "State", True, processes=processes)),
+        ("plot_top_names_by_state", lambda processes: functions.plot_top_names_by_state(state, processes=processes)),
+    ]
+
+def measure_scaling(national, state, process_counts, repeat=1):
+    """
+    This function measures how the per-state work scales with the number of processes, starting every run from the dataset caches on disk.
+    Returns {case: {"serial_seconds", "processes": {count: {"seconds", "speedup"}}}}, where the speedup is serial_seconds / seconds,
+    so a linear scaling gives a speedup equal to the number of processes (as long as there are as many free cores).
+    """
+    scaling = {}
+    nothing = lambda: None
+    for name, run in _scaling_cases(national, state):
+        serial_seconds = _measure(nothing, lambda _: run(None), repeat, False)["seconds"]
+        scaling[name] = {"serial_seconds": serial_seconds, "processes": {}}
+        for count in process_counts:
+            seconds = _measure(nothing, lambda _: run(count), repeat, False)["seconds"]
+            scaling[name]["processes"][str(count)] = {"seconds": seconds, "speedup": serial_seconds / seconds}
+    return scaling
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout != ""
+    except (OSError, subprocess.CalledProcessError): # not a git checkout, or git is not installed
+        commit, dirty = None, None
+    return {"git_commit": commit, "git_dirty": dirty, "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "numpy": np.__version__, "pandas": pd.__version__, "matplotlib": matplotlib.__version__, "plotly": plotly.__version__}
+
+def run_benchmark(scales=(1,), seed=0, repeat=1, data_dir="benchmark_data", measure_memory=True, processes=None, scaling_processes=()):
+    """
+    This function generates (or reuses) the synthetic datasets of every scale, measures all benchmark cases on them and returns the report as a dictionary:
+    {"format", "seed", "repeat", "processes", "environment": versions and git commit,
+     "scales": {scale: {"datasets": rows of the datasets, "results": {"stage/<stage>/<case>" or "function/<case>": {"seconds", "seconds_all", "peak_memory_mb"}},
+                        "scaling": the result of 'measure_scaling', only if scaling_processes is not empty}}}
+
+    Parameters:
+    scales - multiples of the real row counts to benchmark, e.g. (1, 10, 100)
+    seed - seed of the synthetic datasets
+    repeat - number of timed runs of every case, the report keeps all of them and their minimum
+    data_dir - folder of the synthetic datasets, one subfolder per scale, the dataset caches and plots are kept in it too
+    measure_memory - if False, the extra run of every case under tracemalloc is skipped
+    processes - passed as processes/render_processes to the functions that accept it, None runs everything in this process
+    scaling_processes - numbers of processes of the scaling measurement (see 'measure_scaling'), e.g. (1, 2, 4, 8), empty to skip it
+    """
+    plt.switch_backend("Agg")
+    report = {"format": REPORT_FORMAT, "seed": seed, "repeat": repeat, "processes": processes, "environment": _environment(), "scales": {}}
+    cache_dir = functions.DATASET_CACHE_DIR
+    try:
+        for scale in scales:
+            scale_dir = os.path.join(data_dir, f"scale_{scale}")
+            print(f"Generating the {scale}x synthetic datasets in {scale_dir}")
+            description = generate_synthetic_datasets(scale_dir, scale, seed)
+            functions.DATASET_CACHE_DIR = os.path.join(scale_dir, ".names_cache")
+            results_dir = tempfile.mkdtemp(prefix="plots_", dir=scale_dir)
+
+            [name_totals] = functions.aggregate_counts(description["national"], [["Name"]]) # also writes the dataset cache the function cases start from
+            top_names = list(name_totals.sort_values(ascending=False, kind="stable").index[:1000])
+            functions.load_dataset(description["state"])
+
+            results = {}
+            with _headless_plotly():
+                for kind, name, setup, run in _benchmark_cases(description["national"], description["state"], results_dir, top_names, processes):
+                    results[f"{kind}/{name}"] = _measure(setup, run, repeat, measure_memory)
+                    measured = results[f"{kind}/{name}"]
+                    memory = f", {measured['peak_memory_mb']:.1f} MB" if measure_memory else ""
+                    print(f"{scale}x {kind}/{name}: {measured['seconds']:.3f} s{memory}")
+                if scaling_processes:
+                    scaling = measure_scaling(description["national"], description["state"], scaling_processes, repeat)
+                    for name, measured in scaling.items():
+                        speedups = ", ".join(f"{count}: {values['speedup']:.2f}x" for count, values in measured["processes"].items())
+                        print(f"{scale}x scaling/{name}: serial {measured['serial_seconds']:.3f} s, speedup on {speedups}")
+            shutil.rmtree(results_dir, ignore_errors=True)
+            report["scales"][str(scale)] = {"datasets": {"NationalNames_rows": description["national_rows"], "StateNames_rows": description["state_rows"]}, "results": results}
+            if scaling_processes:
+                report["scales"][str(scale)]["scaling"] = scaling
+    finally:
+        functions.DATASET_CACHE_DIR = cache_dir
+        functions.clear_memory_caches()
+    return report
+
+def compare_reports(old_report, new_report):
+    """
+    This function prints, for every case measured in both reports, the old and new time and peak memory and their ratio new / old.
+    """
+    print(f"old: {old_report['environment']['git_commit']}, new: {new_report['environment']['git_commit']}")
+    print(f"{'case':<90} {'old s':>9} {'new s':>9} {'ratio':>6} {'old MB':>9} {'new MB':>9} {'ratio':>6}")
+    for scale in sorted(set(old_report["scales"]) & set(new_report["scales"]), key=float):
+        old_results, new_results = old_report["scales"][scale]["results"], new_report["scales"][scale]["results"]
+        for case in sorted(set(old_results) & set(new_results)):
+            old, new = old_results[case], new_results[case]
+            line = f"{scale + 'x ' + case:<90} {old['seconds']:>9.3f} {new['seconds']:>9.3f} {new['seconds'] / old['seconds']:>6.2f}"
+            if "peak_memory_mb" in old and "peak_memory_mb" in new:
+                line += f" {old['peak_memory_mb']:>9.1f} {new['peak_memory_mb']:>9.1f} {new['peak_memory_mb'] / max(old['peak_memory_mb'], 1e-9):>6.2f}"
+            print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of functions.py on synthetic NationalNames/StateNames datasets.")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1], help="multiples of the real row counts, e.g. 1 10 100")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic datasets")
+    parser.add_argument("--repeat", type=int, default=1, help="number of timed runs of every case")
+    parser.add_argument("--processes", type=int, default=None, help="number of processes for the functions that accept it")
+    parser.add_argument("--scaling", type=int, nargs="+", default=[], metavar="PROCESSES", help="also measure the state work on these numbers of processes, e.g. 1 2 4 8")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurement")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_data"), help="folder of the synthetic datasets")
+    parser.add_argument("--report", default="benchmark_report.json", help="path of the JSON report")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports instead of running the benchmark")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            compare_reports(json.load(old_file), json.load(new_file))
+        sys.exit()
+
+    scales = [int(scale) if scale.is_integer() else scale for scale in args.scales]
+    report = run_benchmark(scales, args.seed, args.repeat, args.data_dir, not args.no_memory, args.processes, args.scaling)
+    with open(args.report, "w") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    print(f"The report has been saved in {args.report}")
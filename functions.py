@@ -3,51 +3,1016 @@ import numpy as np
 import matplotlib.pyplot as plt
 import random
 import os
-from sklearn.linear_model import LinearRegression
+import hashlib
+import json
+import shutil
+import weakref
+import threading
+import time
+import sys
+import functools
+import collections
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import resource
+except ImportError: # not available on Windows, the profiling spans then record no peak RSS
+    resource = None
 import plotly.express as px
 
+DATASET_CACHE_DIR = os.environ.get("NAMES_DATASET_CACHE_DIR") # directory for the binary columnar caches, if None the cache is stored in a '.names_cache' folder next to the CSV file
+_loaded_datasets = {} # datasets already opened in this process, keyed by the same key as the cache on disk
+_memo_locks = {} # one lock per memoized object, so that threads asking for the same dataset, index or aggregate at the same time compute it only once
+_memo_locks_guard = threading.Lock()
+
+def _memo_lock(memo_key):
+    with _memo_locks_guard:
+        return _memo_locks.setdefault(memo_key, threading.RLock())
+
+def clear_memory_caches():
+    """
+    This function forgets everything memoized in this process (datasets, name indexes, aggregates, engines, samplers and scanners),
+    so the next call of any function starts again from the caches on disk. The caches on disk are kept.
+    It is used e.g. by 'benchmark.py' to measure every function from the same starting point.
+    """
+    for memo in (_loaded_datasets, _loaded_name_indexes, _loaded_range_query_engines, _aggregates, _loaded_unisex_name_samplers, _loaded_rolling_trend_scanners):
+        memo.clear()
+
+PROFILE_PATH = None # file receiving the profiling spans, None when profiling is disabled, set by 'enable_profiling' or by the environment variable NAMES_PROFILE
+_profile_lock = threading.Lock()
+
+def enable_profiling(path):
+    """
+    This function turns on the profiling spans of all analysis stages (see 'profile_span') and appends them to the file at 'path':
+    - a path ending with '.json' gets the Chrome trace event format, which can be opened in chrome://tracing or https://ui.perfetto.dev
+      (the closing bracket of the event list is left out, which both viewers accept, so later runs and processes can keep appending)
+    - any other path gets JSON lines, one object per span with the keys stage, name, start (Unix time), wall_seconds, cpu_seconds,
+      peak_rss_mb, peak_rss_growth_mb, rows, pid, thread and error
+    None turns the profiling off. Setting the environment variable NAMES_PROFILE to a path does the same when this module is imported.
+    """
+    global PROFILE_PATH
+    if path is not None and path.endswith(".json") and (not os.path.isfile(path) or os.path.getsize(path) == 0):
+        with open(path, "w") as f:
+            f.write("[\n")
+    PROFILE_PATH = path
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10 # bytes on macOS, kilobytes on Linux
+
+def _write_profile_record(record):
+    if PROFILE_PATH.endswith(".json"):
+        line = json.dumps({"name": record["name"], "cat": record["stage"], "ph": "X", 
+                           "ts": record["start"] * 1e6, "dur": record["wall_seconds"] * 1e6, "pid": record["pid"], "tid": record["thread"], 
+                           "args": {key: record[key] for key in ("cpu_seconds", "peak_rss_mb", "peak_rss_growth_mb", "rows", "error")}}) + ",\n"
+    else:
+        line = json.dumps(record) + "\n"
+    with _profile_lock:
+        with open(PROFILE_PATH, "a") as f:
+            f.write(line)
+
+class _ProfileSpan:
+    def __init__(self, stage, name, rows):
+        self.stage = stage
+        self.name = name
+        self.rows = rows
+
+    def set_rows(self, rows):
+        self.rows = int(rows)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.peak_rss_at_start = _peak_rss_mb()
+        self.cpu_at_start = time.thread_time()
+        self.wall_at_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self.wall_at_start
+        cpu_seconds = time.thread_time() - self.cpu_at_start
+        peak_rss = _peak_rss_mb()
+        _write_profile_record({"stage": self.stage, "name": self.name, "start": self.start, "wall_seconds": wall_seconds, "cpu_seconds": cpu_seconds, 
+                               "peak_rss_mb": peak_rss, "peak_rss_growth_mb": None if peak_rss is None else peak_rss - self.peak_rss_at_start, 
+                               "rows": self.rows, "pid": os.getpid(), "thread": threading.get_ident(), 
+                               "error": None if exc_type is None else exc_type.__name__})
+        return False
+
+class _DisabledSpan:
+    def set_rows(self, rows):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_DISABLED_SPAN = _DisabledSpan()
+
+def profile_span(stage, name, rows=None):
+    """
+    This function returns a context manager measuring one stage of the analysis, e.g.
+
+        with profile_span("aggregate", "NationalNames Name+Year") as span:
+            ...
+            span.set_rows(len(df))
+
+    stage - 'load', 'aggregate', 'model', 'render' or 'analysis' (a whole public function, containing the spans of its stages)
+    name - what is measured, shown in the trace
+    rows - number of input rows processed, can also be set later by span.set_rows
+
+    A span records its wall time, the CPU time of its thread, the peak RSS of the process at its end and how much the span raised it
+    (None on Windows, where the 'resource' module is missing), the rows and the exception, if the stage failed.
+    When profiling is disabled (see 'enable_profiling'), the same shared do-nothing object is returned, so a span costs one function call.
+    """
+    if PROFILE_PATH is None:
+        return _DISABLED_SPAN
+    return _ProfileSpan(stage, name, rows)
+
+def profiled(stage):
+    """
+    Decorator measuring every call of a function as one span (see 'profile_span') named after the function.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if PROFILE_PATH is None:
+                return function(*args, **kwargs)
+            with _ProfileSpan(stage, function.__name__, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+if os.environ.get("NAMES_PROFILE"):
+    enable_profiling(os.environ["NAMES_PROFILE"])
+
+DATASET_CACHE_FORMAT = 3 # part of the cache key, increasing it invalidates caches written by older versions of this file
+
+def _dataset_cache_key(file_path):
+    """
+    This function builds the key under which a CSV file is cached. The key changes whenever the file path, file size or modification time changes,
+    so a re-downloaded or edited CSV is never served from a stale cache.
+    """
+    file_path = os.path.abspath(file_path)
+    file_stat = os.stat(file_path)
+    key_source = f"{file_path}|{file_stat.st_size}|{file_stat.st_mtime_ns}|{DATASET_CACHE_FORMAT}"
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return f"{stem}_{hashlib.sha1(key_source.encode()).hexdigest()[:16]}"
+
+def _dataset_cache_root(file_path):
+    return DATASET_CACHE_DIR if DATASET_CACHE_DIR is not None else os.path.join(os.path.dirname(os.path.abspath(file_path)), ".names_cache")
+
+def dataset_cache_dir(file_path):
+    """
+    Returns the folder in which 'load_dataset' caches the CSV file, deleting it makes the next load read the CSV again.
+    """
+    return os.path.join(_dataset_cache_root(file_path), _dataset_cache_key(file_path))
+
+_vocabularies = {} # column -> sorted pandas Index of every value of the column seen in this process, the categories of all encoded datasets
+_vocabularies_lock = threading.RLock()
+_synced_vocabulary_roots = set() # cache roots whose stored vocabularies were already merged into _vocabularies
+
+def _shared_vocabulary(column, values):
+    """
+    This function returns the shared vocabulary of a column (see 'encode_dataset'), extended by the sorted unique values if some of them are new,
+    and the position of every value in it.
+    Extending the vocabulary makes the datasets and aggregates memoized so far use old categories, so they are forgotten and re-read from disk.
+    """
+    with _vocabularies_lock:
+        vocabulary = _vocabularies.get(column)
+        positions = None if vocabulary is None else vocabulary.get_indexer(values)
+        if positions is None or (positions < 0).any():
+            if vocabulary is not None:
+                _loaded_datasets.clear()
+                _aggregates.clear()
+            vocabulary = pd.Index(values, dtype=object) if vocabulary is None else vocabulary.union(pd.Index(values, dtype=object))
+            _vocabularies[column] = vocabulary
+            positions = vocabulary.get_indexer(values)
+        return vocabulary, positions
+
+def _shared_categorical(column, codes, values):
+    """
+    This function converts codes into the sorted unique 'values' of a column into a pandas Categorical over the shared vocabulary of the column.
+    When the values are the whole vocabulary, the codes are used as they are (a memory-mapped array stays memory-mapped), otherwise they are translated.
+    """
+    vocabulary, positions = _shared_vocabulary(column, values)
+    if len(positions) != len(vocabulary):
+        codes = np.append(positions, -1).astype(np.int32)[codes] # a missing value keeps the code -1
+    return pd.Categorical.from_codes(codes, categories=vocabulary, validate=False)
+
+def _sync_vocabularies(cache_root):
+    """
+    This function keeps the shared vocabularies stored in the cache root (vocabulary/<column>.npy, next to the dataset caches) and the ones of this process equal:
+    the stored ones are merged in once per process, and the ones of this process are stored whenever they have more values.
+    Every run then encodes all datasets of the cache root over the same categories from the start, whichever dataset is loaded first.
+    """
+    vocabulary_dir = os.path.join(cache_root, "vocabulary")
+    with _vocabularies_lock:
+        stored = {}
+        if os.path.isdir(vocabulary_dir):
+            for file_name in os.listdir(vocabulary_dir):
+                if file_name.endswith(".npy"):
+                    stored[file_name[:-len(".npy")]] = np.load(os.path.join(vocabulary_dir, file_name))
+        if cache_root not in _synced_vocabulary_roots:
+            for column, values in stored.items():
+                _shared_vocabulary(column, values)
+            _synced_vocabulary_roots.add(cache_root)
+        for column, vocabulary in _vocabularies.items():
+            if column not in stored or len(stored[column]) < len(vocabulary):
+                os.makedirs(vocabulary_dir, exist_ok=True)
+                tmp_path = os.path.join(vocabulary_dir, f"{column}.npy.tmp{os.getpid()}")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, np.asarray(vocabulary, dtype=str))
+                os.replace(tmp_path, os.path.join(vocabulary_dir, f"{column}.npy"))
+
+_COMPACT_INTEGER_DTYPES = {"Year": np.int16, "Count": np.int32, "Id": np.int32} # integer columns not listed here, or with values that do not fit, stay int64
+
+def encode_dataset(df):
+    """
+    This function converts a dataset as read by pd.read_csv into the compact representation used by all analysis functions:
+    Name, Gender and State become pandas categoricals (an integer code per row plus the sorted vocabulary of the unique values),
+    Year is downcast to int16, Count and Id to int32.
+    On a StateNames-sized frame this takes over 10x less memory than the object strings and int64 columns, and grouping by the integer codes is about 2x faster.
+
+    The vocabulary of a column is shared by all datasets of the process (see '_shared_vocabulary'), so e.g. the Name columns of the NationalNames
+    and StateNames datasets and of all their aggregates have the same categories and are merged and concatenated by their codes.
+    The vocabulary is sorted, so grouping by a categorical column gives the same order as grouping by the original strings.
+    All grouping on these columns has to be done with observed=True, otherwise pandas creates a group for every category of the vocabulary.
+    """
+    encoded = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            encoded[column] = _shared_categorical(column, values.cat.codes.to_numpy(), np.asarray(values.cat.categories, dtype=str))
+        elif pd.api.types.is_integer_dtype(values):
+            dtype = _COMPACT_INTEGER_DTYPES.get(column, np.int64)
+            fits = len(values) == 0 or (values.min() >= np.iinfo(dtype).min and values.max() <= np.iinfo(dtype).max)
+            encoded[column] = values.astype(dtype if fits else np.int64)
+        elif pd.api.types.is_numeric_dtype(values):
+            encoded[column] = values
+        else:
+            codes, vocabulary = pd.factorize(values, sort=True) # missing values get the code -1
+            encoded[column] = _shared_categorical(column, codes.astype(np.int32), np.asarray(vocabulary, dtype=str))
+    return pd.DataFrame(encoded)
+
+def _write_dataset_cache(df, cache_dir):
+    """
+    This function stores an encoded dataset (see 'encode_dataset') as the binary columnar cache: one .npy file per column.
+    Numeric columns are stored as they are, categorical columns (Name, Gender, State) as their integer codes plus the array of the vocabulary,
+    so that nothing in the cache needs pickling and every column can be memory-mapped.
+    The vocabulary is the shared one at the time of writing, '_read_dataset_cache' translates the codes if the shared vocabulary has grown since.
+    """
+    tmp_dir = _make_tmp_dir(cache_dir)
+    columns = []
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, f"{column}.codes.npy"), values.cat.codes.to_numpy())
+            np.save(os.path.join(tmp_dir, f"{column}.values.npy"), np.asarray(values.cat.categories, dtype=str))
+            columns.append({"name": column, "kind": "categorical"})
+        else:
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), values.to_numpy())
+            columns.append({"name": column, "kind": "numeric"})
+    with open(os.path.join(tmp_dir, "columns.json"), "w") as f:
+        json.dump(columns, f)
+    _publish_dir(tmp_dir, cache_dir) # the cache appears only once it is complete, an interrupted conversion is never read
+
+def _make_tmp_dir(target_dir):
+    """
+    Creates an empty temporary directory next to target_dir, with a unique name so that a directory left over by an interrupted run is never reused.
+    """
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix=os.path.basename(target_dir) + ".tmp", dir=parent)
+
+def _publish_dir(tmp_dir, target_dir):
+    """
+    Moves a completely written temporary directory (see '_make_tmp_dir') to target_dir.
+    A directory already at target_dir is one left over by an interrupted run (e.g. the totals of a generation its manifest never pointed to)
+    and is replaced. If another process publishes the same directory at the same moment, its copy is kept and this one is removed.
+    """
+    if os.path.isdir(target_dir):
+        shutil.rmtree(target_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, target_dir)
+    except OSError:
+        if not os.path.isdir(target_dir):
+            raise
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _read_dataset_cache(cache_dir):
+    with open(os.path.join(cache_dir, "columns.json")) as f:
+        columns = json.load(f)
+    data = {}
+    for column in columns:
+        name = column["name"]
+        if column["kind"] == "numeric":
+            data[name] = np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r")
+        else:
+            codes = np.load(os.path.join(cache_dir, f"{name}.codes.npy"), mmap_mode="r")
+            data[name] = _shared_categorical(name, codes, np.load(os.path.join(cache_dir, f"{name}.values.npy")))
+    return pd.DataFrame(data, copy=False)
+
+def load_dataset(dataset):
+    """
+    This function is the single entry point for getting a dataset into memory. Every analysis function passes its dataset input through it.
+
+    Parameter:
+    dataset - either a path to the NationalNames/StateNames CSV file, or an already loaded pandas DataFrame
+              (which is returned unchanged, it should be encoded by 'encode_dataset' if it comes from elsewhere than this function)
+
+    The first time a CSV file is loaded, it is parsed once, encoded into the compact representation (see 'encode_dataset')
+    and stored as a binary columnar cache (see '_write_dataset_cache').
+    Later loads, also in new runs of main.py, skip the CSV parsing and open the cache directly. Within one run the loaded frame is also kept in memory,
+    so calling several functions with the same path parses nothing twice. The returned frame is shared, it should not be modified in place.
+    """
+    if isinstance(dataset, pd.DataFrame):
+        return dataset
+
+    cache_dir = dataset_cache_dir(dataset)
+    with _memo_lock(cache_dir):
+        if cache_dir in _loaded_datasets:
+            return _loaded_datasets[cache_dir]
+
+        cache_root = _dataset_cache_root(dataset)
+        if cache_root not in _synced_vocabulary_roots and os.path.isdir(cache_root):
+            _sync_vocabularies(cache_root)
+        if not os.path.isdir(cache_dir):
+            with profile_span("load", f"read_csv {os.path.basename(dataset)}") as span:
+                df = encode_dataset(pd.read_csv(dataset))
+                span.set_rows(len(df))
+            try:
+                _write_dataset_cache(df, cache_dir)
+                _sync_vocabularies(cache_root)
+            except OSError as error: # e.g. read-only dataset folder, the analysis still works, only without the cache
+                print(f"Could not write the dataset cache {cache_dir}: {error}")
+        else:
+            with profile_span("load", f"read cache {os.path.basename(dataset)}") as span:
+                df = _read_dataset_cache(cache_dir)
+                span.set_rows(len(df))
+
+        _loaded_datasets[cache_dir] = df
+        return df
+
+_loaded_name_indexes = {} # name indexes already built or opened in this process
+
+class NameSeriesIndex:
+    """
+    This class is a lookup table from a name (or a name and a state) to its yearly counts, summed over genders.
+    All series are stored one after another in sorted arrays, 'years' and 'counts', and every key points to its own contiguous slice of them,
+    so getting the series of one name does not need to scan the whole dataset.
+    'peaks' is aligned with 'counts' and holds the largest count of a single record (one gender) of the year, the maximum the analysis functions report.
+
+    It is created by 'load_name_index', which also stores it on disk next to the dataset cache.
+    """
+    def __init__(self, key_columns, keys, offsets, years, counts, peaks):
+        self.key_columns = tuple(key_columns) # ("Name",) or ("Name", "State")
+        self.keys = keys # one array per key column, the i-th key owns years[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.years = years
+        self.counts = counts
+        self.peaks = peaks
+        key_values = [column.tolist() for column in keys]
+        self._positions = dict(zip(key_values[0] if len(key_values) == 1 else zip(*key_values), range(len(offsets) - 1)))
+
+    def series(self, name, state=None):
+        """
+        Returns the yearly counts of the name as a pandas Series indexed by year (empty if the name is not in the dataset).
+        The state is used only if the index is built per name and state.
+        """
+        return self._series(self.counts, name, state)
+
+    def peak_series(self, name, state=None):
+        """
+        Returns the largest count of a single record (one gender) of the name in every year, as a pandas Series indexed by year like 'series'.
+        """
+        return self._series(self.peaks, name, state)
+
+    def _series(self, values, name, state):
+        key = name if len(self.key_columns) == 1 else (name, state)
+        position = self._positions.get(key)
+        if position is None:
+            return pd.Series(np.array([], dtype=values.dtype), index=pd.Index(np.array([], dtype=self.years.dtype), name="Year"), name="Count")
+        start, stop = self.offsets[position], self.offsets[position + 1]
+        return pd.Series(values[start:stop], index=pd.Index(self.years[start:stop], name="Year"), name="Count")
+
+    def series_many(self, names, state=None):
+        """
+        Batch variant of 'series', returns a dictionary {name: yearly counts}.
+        """
+        return {name: self.series(name, state) for name in names}
+
+@profiled("aggregate")
+def _build_name_index(dataset, key_columns):
+    [grouped] = aggregate_counts(dataset, [list(key_columns) + ["Year", "Gender"]]) # sorted by the key, the year and the gender, the genders of a year are neighbours
+    year_codes = grouped.index.codes[len(key_columns)]
+    year_changes = np.zeros(len(grouped), dtype=bool)
+    year_changes[:1] = True
+    year_changes[1:] = year_codes[1:] != year_codes[:-1]
+    key_codes = [grouped.index.codes[level] for level in range(len(key_columns))]
+    key_changes = np.zeros(len(grouped), dtype=bool)
+    key_changes[:1] = True
+    for codes in key_codes:
+        key_changes[1:] |= codes[1:] != codes[:-1] # a new key starts wherever any of the key columns changes
+    year_starts = np.flatnonzero(year_changes | key_changes) # one entry of the index per key and year
+    counts = np.add.reduceat(grouped.to_numpy(), year_starts)
+    peaks = np.maximum.reduceat(grouped.to_numpy(), year_starts)
+    years = grouped.index.get_level_values("Year").to_numpy()[year_starts]
+    starts = np.flatnonzero(key_changes[year_starts])
+    keys = [np.asarray(grouped.index.levels[level].take(key_codes[level][year_starts[starts]]), dtype=str) for level in range(len(key_columns))]
+    offsets = np.append(starts, len(year_starts)).astype(np.int64)
+    return NameSeriesIndex(key_columns, keys, offsets, years, counts, peaks)
+
+def _write_name_index(index, index_dir):
+    tmp_dir = _make_tmp_dir(index_dir)
+    for column, keys in zip(index.key_columns, index.keys):
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), keys)
+    np.save(os.path.join(tmp_dir, "offsets.npy"), index.offsets)
+    np.save(os.path.join(tmp_dir, "years.npy"), index.years)
+    np.save(os.path.join(tmp_dir, "counts.npy"), index.counts)
+    np.save(os.path.join(tmp_dir, "peaks.npy"), index.peaks)
+    _publish_dir(tmp_dir, index_dir)
+
+def _read_name_index(index_dir, key_columns):
+    keys = [np.load(os.path.join(index_dir, f"{column}.npy")) for column in key_columns]
+    return NameSeriesIndex(key_columns,
+                           keys,
+                           np.load(os.path.join(index_dir, "offsets.npy")),
+                           np.load(os.path.join(index_dir, "years.npy"), mmap_mode="r"),
+                           np.load(os.path.join(index_dir, "counts.npy"), mmap_mode="r"),
+                           np.load(os.path.join(index_dir, "peaks.npy"), mmap_mode="r"))
+
+def load_name_index(dataset, by_state=False):
+    """
+    This function returns the NameSeriesIndex of a dataset, building it only the first time.
+
+    Parameters:
+    dataset - path to the NationalNames/StateNames CSV file, or a DataFrame returned by 'load_dataset'
+    by_state - if False, the index is keyed by the name only (counts summed over all states of the StateNames dataset),
+               if True, it is keyed by the name and the state, which needs the StateNames dataset
+
+    For a path, the index is stored on disk in the dataset cache folder, so it survives between runs and is invalidated together with the cache.
+    """
+    key_columns = ("Name", "State") if by_state else ("Name",)
+
+    if isinstance(dataset, pd.DataFrame):
+        memo_key = (id(dataset), key_columns)
+        with _memo_lock(memo_key):
+            if memo_key in _loaded_name_indexes and _loaded_name_indexes[memo_key][0]() is dataset: # the frame is checked by a weak reference, a reused id() is never served
+                return _loaded_name_indexes[memo_key][1]
+            index = _build_name_index(dataset, key_columns)
+            _loaded_name_indexes[memo_key] = (weakref.ref(dataset), index)
+            return index
+
+    index_dir = os.path.join(dataset_cache_dir(dataset), "index_" + "_".join(key_columns))
+    memo_key = (index_dir, key_columns)
+    with _memo_lock(memo_key):
+        if memo_key in _loaded_name_indexes:
+            return _loaded_name_indexes[memo_key]
+
+        if os.path.isdir(index_dir):
+            with profile_span("load", f"read name index {'+'.join(key_columns)} {os.path.basename(dataset)}") as span:
+                index = _read_name_index(index_dir, key_columns)
+                span.set_rows(len(index.counts))
+        else:
+            index = _build_name_index(dataset, key_columns)
+            try:
+                _write_name_index(index, index_dir)
+            except OSError as error:
+                print(f"Could not write the name index {index_dir}: {error}")
+
+        _loaded_name_indexes[memo_key] = index
+        return index
+
+_loaded_range_query_engines = {} # range query engines already built in this process, keyed by the name index they were built from
+
+class NameRangeQueryEngine:
+    """
+    This class answers statistics of a name (or a name in a state) over any period of years in constant time per query, without scanning any rows.
+
+    It is built from a NameSeriesIndex and holds, for every key:
+    dense - the largest count of a single record (one gender) in every year (see NameSeriesIndex.peaks) as one row of a (keys x years) array, with 0 for years without a record
+    cumulative - prefix sums of the yearly counts (summed over genders), the total over the years [a, b] is cumulative[b + 1] - cumulative[a]
+    sparse_table - for every power of two 2^k, the position of the maximum of dense[i : i + 2^k],
+                   the maximum over any period is then the larger of two overlapping blocks (the earlier year on a tie)
+
+    The memory is about (8 + 8 + log2(number of years)) bytes per key and year, e.g. ~ 300 MB for the whole NationalNames dataset.
+    """
+    def __init__(self, name_index):
+        self.key_columns = name_index.key_columns
+        years = np.asarray(name_index.years)
+        self.first_year = int(years.min())
+        self.number_of_years = int(years.max()) - self.first_year + 1
+        number_of_keys = len(name_index.offsets) - 1
+
+        rows = np.repeat(np.arange(number_of_keys), np.diff(name_index.offsets)) # the key of every entry of the index
+        self.dense = np.zeros((number_of_keys, self.number_of_years), dtype=np.int64)
+        self.dense[rows, years - self.first_year] = name_index.counts
+        self.cumulative = np.zeros((number_of_keys, self.number_of_years + 1), dtype=np.int64)
+        np.cumsum(self.dense, axis=1, out=self.cumulative[:, 1:])
+        self.dense[rows, years - self.first_year] = name_index.peaks # the same entries, the counts are no longer needed
+
+        position_dtype = np.min_scalar_type(self.number_of_years - 1)
+        self.sparse_table = [np.broadcast_to(np.arange(self.number_of_years, dtype=position_dtype), self.dense.shape)] # level 0, every block is a single year
+        block = 1
+        while 2 * block <= self.number_of_years:
+            previous = self.sparse_table[-1]
+            width = self.number_of_years - 2 * block + 1
+            left = previous[:, :width]
+            right = previous[:, block:block + width]
+            left_is_larger = np.take_along_axis(self.dense, left, axis=1) >= np.take_along_axis(self.dense, right, axis=1)
+            self.sparse_table.append(np.where(left_is_larger, left, right))
+            block *= 2
+
+        if len(self.key_columns) == 1:
+            self._keys = pd.Index(name_index.keys[0])
+        else:
+            self._keys = pd.MultiIndex.from_arrays(name_index.keys)
+
+    @profiled("model")
+    def query(self, names, start_years, end_years, states=None):
+        """
+        Answers many queries in one vectorized call. The i-th query asks about names[i] between start_years[i] and end_years[i] (both included).
+        start_years and end_years can also be single years shared by all queries, states are needed only if the engine is built per name and state.
+
+        Returns a pandas DataFrame with one row per query and the columns:
+        Name, (State), Start_Year, End_Year, Total_Occurrence, Average_Occurrence, Max_Yearly_Occurrence, Max_Year.
+        Average_Occurrence is the total divided by the number of years of the period, the same as in 'average_occurrence_in_time_period_national'.
+        Max_Year is missing (<NA>) when the name has no record in the period.
+        """
+        names = np.asarray(names, dtype=object)
+        start_years = np.broadcast_to(np.asarray(start_years, dtype=np.int64), names.shape)
+        end_years = np.broadcast_to(np.asarray(end_years, dtype=np.int64), names.shape)
+        if len(self.key_columns) == 1:
+            rows = self._keys.get_indexer(names)
+        else:
+            states = np.broadcast_to(np.asarray(states, dtype=object), names.shape)
+            rows = self._keys.get_indexer(pd.MultiIndex.from_arrays([names, states]))
+
+        first = np.clip(start_years - self.first_year, 0, self.number_of_years) # positions of the period in the dense arrays, limited to the recorded years
+        stop = np.clip(end_years - self.first_year + 1, 0, self.number_of_years)
+        valid = (rows >= 0) & (stop > first)
+        rows, first, stop = rows[valid], first[valid], stop[valid]
+
+        total = np.zeros(len(names), dtype=np.int64)
+        total[valid] = self.cumulative[rows, stop] - self.cumulative[rows, first]
+        num_years = end_years - start_years + 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            average = np.where(num_years > 0, total / num_years, 0.0)
+
+        level = np.floor(np.log2(stop - first)).astype(np.int64) # the largest block that fits into the period
+        block = np.left_shift(1, level)
+        peak_position = np.zeros(len(rows), dtype=np.int64)
+        for k in np.unique(level):
+            selected = level == k
+            left = self.sparse_table[k][rows[selected], first[selected]].astype(np.int64)
+            right = self.sparse_table[k][rows[selected], stop[selected] - block[selected]].astype(np.int64)
+            left_is_larger = self.dense[rows[selected], left] >= self.dense[rows[selected], right]
+            peak_position[selected] = np.where(left_is_larger, left, right)
+
+        max_count = np.zeros(len(names), dtype=np.int64)
+        max_count[valid] = self.dense[rows, peak_position]
+        max_year = pd.array(np.full(len(names), pd.NA), dtype="Int64")
+        max_year[valid] = self.first_year + peak_position
+        max_year[total == 0] = pd.NA # no record of the name in the period
+
+        result = {"Name": names}
+        if len(self.key_columns) > 1:
+            result["State"] = states
+        result["Start_Year"] = start_years
+        result["End_Year"] = end_years
+        result["Total_Occurrence"] = total
+        result["Average_Occurrence"] = average
+        result["Max_Yearly_Occurrence"] = max_count
+        result["Max_Year"] = max_year
+        return pd.DataFrame(result) # built at once, inserting the columns one by one took most of the time of a single query
+
+def load_range_query_engine(dataset, by_state=False):
+    """
+    This function returns the NameRangeQueryEngine of a dataset, built from its name index (see 'load_name_index') the first time it is needed.
+
+    Parameters:
+    dataset - path to the NationalNames/StateNames CSV file, or a DataFrame returned by 'load_dataset'
+    by_state - if True, the queries are per name and state, which needs the StateNames dataset
+    """
+    name_index = load_name_index(dataset, by_state=by_state)
+    memo_key = id(name_index)
+    with _memo_lock(("range_query_engine", memo_key)):
+        if memo_key in _loaded_range_query_engines and _loaded_range_query_engines[memo_key][0]() is name_index:
+            return _loaded_range_query_engines[memo_key][1]
+        with profile_span("model", "build NameRangeQueryEngine", rows=len(name_index.counts)):
+            engine = NameRangeQueryEngine(name_index)
+        _loaded_range_query_engines[memo_key] = (weakref.ref(name_index), engine)
+        return engine
+
+PERSIST_AGGREGATES = os.environ.get("NAMES_PERSIST_AGGREGATES") == "1" # if True, 'aggregate_counts' also stores its results in the dataset cache folder, so they are reused by later runs
+_aggregates = {} # results of 'aggregate_counts' already computed in this process
+
+def _aggregate_dir(file_path, grouping):
+    return dataset_cache_dir(file_path) + ".aggregates" + os.sep + "_".join(grouping) # outside of the dataset cache folder, which appears only once complete
+
+def _memoized_aggregate(memo_key, dataset):
+    if memo_key not in _aggregates:
+        return None
+    dataset_ref, totals = _aggregates[memo_key]
+    if dataset_ref is not None and dataset_ref() is not dataset: # the frame is checked by a weak reference, a reused id() is never served
+        return None
+    return totals
+
+def _write_aggregate(totals, aggregate_dir):
+    _write_dataset_cache(encode_dataset(totals.reset_index()), aggregate_dir)
+
+def _read_aggregate(aggregate_dir, grouping):
+    return _aggregate_from_frame(_read_dataset_cache(aggregate_dir), grouping)
+
+def _aggregate_from_frame(frame, grouping):
+    """
+    This function turns an encoded frame of the grouping columns and Count (see 'encode_dataset') into an aggregate of the same form as the in-memory groupby:
+    categorical Name, Gender and State levels over the shared vocabularies, compact integer levels and int64 sums.
+    """
+    return frame.set_index(grouping)["Count"].astype(np.int64)
+
+_state_worker_dataset = None # the StateNames dataset of a worker process of '_map_states', opened once per process by '_init_state_worker'
+_state_worker_rows = None # (row positions ordered by state, bounds of every state code in them) of the dataset of the worker process
+
+def _state_codes(df):
+    """
+    Returns the integer code of the state of every row (-1 for a missing state) and the states the codes stand for.
+    """
+    if isinstance(df["State"].dtype, pd.CategoricalDtype):
+        return df["State"].cat.codes.to_numpy(), df["State"].cat.categories
+    return pd.factorize(df["State"], sort=True)
+
+def _init_state_worker(dataset, categories, profile_path):
+    global _state_worker_dataset, _state_worker_rows
+    if profile_path is not None:
+        enable_profiling(profile_path)
+    df = load_dataset(dataset)
+    for column, vocabulary in categories.items():
+        if not df[column].cat.categories.equals(vocabulary): # a process not forked from the parent has its own vocabularies, the codes sent back have to be the parent's
+            df = df.assign(**{column: df[column].cat.set_categories(vocabulary)})
+    _state_worker_dataset = df
+    state_codes, states = _state_codes(df)
+    order = np.argsort(state_codes, kind="stable") # the rows are partitioned by state once per process, a radix sort for the small integer codes
+    _state_worker_rows = order, np.searchsorted(state_codes[order], np.arange(len(states) + 1))
+
+def _run_state_task(state_code, reduce_state, arguments):
+    order, bounds = _state_worker_rows
+    partition = _state_worker_dataset.iloc[order[bounds[state_code]:bounds[state_code + 1]]] # the rows of the state, in the order of the dataset
+    return [frame.assign(**{column: frame[column].cat.codes.to_numpy() for column in frame.columns if isinstance(frame[column].dtype, pd.CategoricalDtype)})
+            for frame in reduce_state(partition, *arguments)] # the codes only, the vocabularies of ~ 100 000 names would be most of the data sent back
+
+def _uses_state_processes(dataset, chunk_size, processes):
+    return processes is not None and not isinstance(dataset, RollupStore) and (chunk_size is None or isinstance(dataset, pd.DataFrame))
+
+def _map_states(dataset, processes, reduce_state, arguments=()):
+    """
+    This function runs reduce_state(rows of one state, *arguments) for every state of the StateNames dataset (51 shards) on a pool of processes.
+    reduce_state returns a list of DataFrames, the result is the list of their concatenations over the states, in the order of the states.
+
+    The rows are not sent to the processes: every process opens the dataset itself once, a path through its memory-mapped cache on disk
+    (written by this process before the pool starts), a DataFrame by inheriting it when the process is forked (it is pickled once per process otherwise),
+    and orders its rows by state once (a stable argsort of the state codes), so every task takes the rows of its state as one slice instead of comparing a whole column.
+    Only the results come back, with their categorical columns as codes into the categories of the dataset, so the whole per-state work runs in parallel and only the concatenation runs in this process.
+    On Windows, a script using it has to call it under if __name__ == "__main__":
+    """
+    df = load_dataset(dataset)
+    categories = {column: df[column].cat.categories for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)}
+    state_codes, states = _state_codes(df)
+    present_codes = np.flatnonzero(np.bincount(state_codes[state_codes >= 0], minlength=len(states))) # the tasks are the states with rows, sent as their codes
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_state_worker, initargs=(dataset, categories, PROFILE_PATH)) as executor:
+        state_results = list(executor.map(_run_state_task, present_codes, [reduce_state] * len(present_codes), [arguments] * len(present_codes)))
+
+    results = []
+    for frames in zip(*state_results):
+        merged = pd.concat(frames, ignore_index=True)
+        for column in merged.columns:
+            if column in categories:
+                merged[column] = pd.Categorical.from_codes(merged[column].to_numpy(), categories=categories[column], validate=False)
+        results.append(merged)
+    return results
+
+def _state_totals(partition, grouping):
+    """
+    This function returns partition.groupby(grouping, observed=True)["Count"].sum() for the rows of one state as a frame with the columns grouping + ['Count'].
+    It groups by the integer codes of the categorical columns: grouping by the categoricals themselves takes time proportional to the whole vocabulary
+    (~ 100 000 names), which for the rows of a single state is several times the work of the sums.
+    """
+    categorical = [isinstance(partition[column].dtype, pd.CategoricalDtype) for column in grouping]
+    keys = [partition[column].cat.codes.to_numpy() if is_categorical else partition[column].to_numpy() for column, is_categorical in zip(grouping, categorical)]
+    sums = partition["Count"].groupby(keys).sum() # sorted by the codes, which is the order of the sorted vocabularies
+    totals = {}
+    for level, (column, is_categorical) in enumerate(zip(grouping, categorical)):
+        values = sums.index.get_level_values(level).to_numpy()
+        totals[column] = pd.Categorical.from_codes(values, categories=partition[column].cat.categories, validate=False) if is_categorical else values
+    totals["Count"] = sums.to_numpy().astype(np.int64)
+    return pd.DataFrame(totals)
+
+def _aggregate_state(partition, groupings):
+    return [_state_totals(partition, grouping) for grouping in groupings]
+
+def _compute_aggregates_by_state(dataset, groupings, processes):
+    """
+    This function computes the aggregates of the StateNames dataset on a pool of processes, one task per state (see '_map_states').
+    The groupings containing 'State' have disjoint groups in different states and are only put together in the order of the states,
+    the other groupings are summed over the states. The result is the same as the one of the serial groupby.
+    """
+    totals = []
+    for grouping, merged in zip(groupings, _map_states(dataset, processes, _aggregate_state, (groupings,))):
+        grouping_totals = _aggregate_from_frame(merged, grouping)
+        if "State" not in grouping:
+            grouping_totals = grouping_totals.groupby(level=list(range(len(grouping))), observed=True).sum()
+        totals.append(grouping_totals)
+    return totals
+
+def _compute_aggregates(dataset, groupings, chunk_size, processes=None, span=_DISABLED_SPAN):
+    if _uses_state_processes(dataset, chunk_size, processes):
+        df = load_dataset(dataset)
+        span.set_rows(len(df))
+        if "State" in df.columns:
+            return _compute_aggregates_by_state(dataset, groupings, processes)
+
+    if chunk_size is None or isinstance(dataset, pd.DataFrame):
+        df = load_dataset(dataset)
+        span.set_rows(len(df))
+        return [df.groupby(grouping, observed=True)["Count"].sum().astype(np.int64) for grouping in groupings]
+
+    needed_columns = sorted({column for grouping in groupings for column in grouping} | {"Count"})
+    totals = [None] * len(groupings)
+    rows = 0
+    for chunk in pd.read_csv(dataset, usecols=needed_columns, chunksize=chunk_size):
+        rows += len(chunk)
+        for i, grouping in enumerate(groupings):
+            partial = chunk.groupby(grouping)["Count"].sum().astype(np.int64) # partial sums of this chunk only
+            if totals[i] is None:
+                totals[i] = partial
+            else:
+                totals[i] = pd.concat([totals[i], partial]).groupby(level=list(range(len(grouping)))).sum() # merging with the sums of the previous chunks, stays sorted like the in-memory groupby
+    span.set_rows(rows)
+    return [_aggregate_from_frame(encode_dataset(grouping_totals.reset_index()), grouping) for grouping, grouping_totals in zip(groupings, totals)] # the strings of the CSV become the same index as in memory
+
+def aggregate_counts(dataset, groupings, chunk_size=None, processes=None):
+    """
+    This function sums the 'Count' column of a dataset for one or more groupings of columns, e.g. [["State", "Name"], ["State"]].
+    It returns a list with one pandas Series per grouping, the same as dataset.groupby(grouping)["Count"].sum() would give.
+    The sums are always int64, so they do not depend on the compact dtypes of the dataset (see 'encode_dataset') and cannot overflow in later arithmetic.
+
+    Parameters:
+    dataset - path to the NationalNames/StateNames CSV file, a DataFrame returned by 'load_dataset', or a RollupStore keeping the groupings
+    groupings - list of lists of column names to group by
+    chunk_size - if None, the whole dataset is loaded into memory by 'load_dataset' (the fastest option).
+                 If set to a number of rows, the CSV file is streamed in chunks of this size instead and only the partial sums of each chunk are kept,
+                 so the peak memory is given by the chunk size and the number of groups, not by the size of the file.
+                 It has no effect when the dataset is already a DataFrame.
+    processes - if None, the aggregates are computed in this process. If set to a number of processes (e.g. os.cpu_count()), the StateNames dataset
+                is partitioned by state and the partitions are aggregated on that many processes (see '_map_states').
+                It has no effect on the NationalNames dataset and when streaming. On Windows, a script using it has to call it under if __name__ == "__main__":
+
+    Every aggregate is computed only once per process and shared by all functions that ask for it (the returned Series should not be modified in place).
+    If PERSIST_AGGREGATES is True, aggregates of a dataset given by its path are also stored next to the dataset cache and reused by later runs.
+    """
+    if isinstance(dataset, RollupStore): # the totals are already materialized
+        return [dataset.totals(grouping) for grouping in groupings]
+
+    in_memory = isinstance(dataset, pd.DataFrame)
+    dataset_key = id(dataset) if in_memory else dataset_cache_dir(dataset)
+
+    with _memo_lock(("aggregates", dataset_key)):
+        totals = {}
+        for grouping in groupings:
+            memo_key = (dataset_key, tuple(grouping))
+            memoized = _memoized_aggregate(memo_key, dataset)
+            if memoized is not None:
+                totals[tuple(grouping)] = memoized
+            elif not in_memory and PERSIST_AGGREGATES and os.path.isdir(_aggregate_dir(dataset, grouping)):
+                totals[tuple(grouping)] = _read_aggregate(_aggregate_dir(dataset, grouping), grouping)
+                _aggregates[memo_key] = (None, totals[tuple(grouping)])
+
+        missing = [grouping for grouping in groupings if tuple(grouping) not in totals]
+        if missing:
+            dataset_label = "DataFrame" if in_memory else os.path.basename(dataset)
+            with profile_span("aggregate", f"{dataset_label} {', '.join('+'.join(grouping) for grouping in missing)}") as span:
+                computed = _compute_aggregates(dataset, missing, chunk_size, processes, span)
+            for grouping, grouping_totals in zip(missing, computed):
+                totals[tuple(grouping)] = grouping_totals
+                _aggregates[(dataset_key, tuple(grouping))] = (weakref.ref(dataset) if in_memory else None, grouping_totals)
+                if not in_memory and PERSIST_AGGREGATES:
+                    try:
+                        _write_aggregate(grouping_totals, _aggregate_dir(dataset, grouping))
+                    except OSError as error:
+                        print(f"Could not write the aggregate {grouping} of {dataset}: {error}")
+
+        return [totals[tuple(grouping)] for grouping in groupings]
+
+ROLLUP_GROUPINGS = {"National": [["Name"], ["Name", "Gender"]], 
+                    "State": [["State", "Name"], ["State"], ["Name", "Gender"]]} # aggregates kept by a RollupStore of each dataset, the ones read by the analysis functions
+
+class RollupStore:
+    """
+    This class keeps the aggregates of one dataset (per-name totals, (State, Name) totals, per-state totals, (Name, Gender) totals) materialized on disk
+    and updates them incrementally when new data arrives, instead of recomputing them from the whole history.
+
+    Every ingested year is recorded with a fingerprint of its rows and its own partial aggregates. On 'ingest', only the years that are new
+    or whose rows changed are aggregated: their new partial aggregates are added to the totals and, for a changed year, the old ones are subtracted.
+    A RollupStore can be passed to 'find_common_national_rare_state', 'random_most_unisex_name', 'top_10_states_most_newborns'
+    and 'plot_top_names_by_state' in place of the dataset path, the functions then read the materialized totals (see 'aggregate_counts').
+
+    Parameters:
+    store_dir - directory of the store, created if it does not exist
+    groupings - list of the groupings to keep, e.g. ROLLUP_GROUPINGS["State"]
+
+    Files in store_dir:
+    manifest.json - the groupings, the fingerprint of every ingested year, the ingested source files and the current generation of the totals
+    totals_<generation>/<grouping>/ - the totals, a new generation is written on every change and becomes valid only once the manifest points to it
+    years/<year>_<fingerprint>/<grouping>/ - the partial aggregates of one year, needed only when that year changes
+    """
+    def __init__(self, store_dir, groupings):
+        self.store_dir = store_dir
+        self.groupings = [list(grouping) for grouping in groupings]
+        self._totals = {} # totals already read from disk
+        manifest_path = os.path.join(store_dir, "manifest.json")
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest["groupings"] != self.groupings:
+                raise ValueError(f"The rollup store {store_dir} keeps the groupings {self.manifest['groupings']}, not {self.groupings}.")
+        else:
+            self.manifest = {"groupings": self.groupings, "generation": None, "years": {}, "sources": []}
+
+    def totals(self, grouping):
+        """
+        Returns the materialized Count totals of the grouping, the same pandas Series as dataset.groupby(grouping)["Count"].sum() of all ingested data.
+        """
+        grouping = list(grouping)
+        if grouping not in self.groupings:
+            raise ValueError(f"The rollup store {self.store_dir} does not keep the grouping {grouping}, only {self.groupings}.")
+        key = tuple(grouping)
+        if key not in self._totals:
+            if self.manifest["generation"] is None:
+                raise ValueError(f"The rollup store {self.store_dir} is empty, data has to be ingested first.")
+            self._totals[key] = _read_aggregate(self._totals_dir(self.manifest["generation"], grouping), grouping)
+        return self._totals[key]
+
+    def _totals_dir(self, generation, grouping):
+        return os.path.join(self.store_dir, f"totals_{generation}", "_".join(grouping))
+
+    def _year_dir(self, year, fingerprint, grouping):
+        return os.path.join(self.store_dir, "years", f"{year}_{fingerprint}", "_".join(grouping))
+
+    @profiled("aggregate")
+    def ingest(self, dataset):
+        """
+        This method adds new data to the store and updates the totals by the difference only.
+
+        Parameter:
+        dataset - path to a NationalNames/StateNames-shaped CSV file, or a DataFrame. It can be the whole re-downloaded dataset or only the rows of the new years.
+                  Years present in the input replace the stored years of the same number, years not present in the input are kept as they are.
+
+        Returns the list of the years that were added or changed (an input file already ingested unchanged is skipped without reading it).
+        """
+        source_key = None if isinstance(dataset, pd.DataFrame) else _dataset_cache_key(dataset)
+        if source_key is not None and source_key in self.manifest["sources"]:
+            return []
+
+        df = load_dataset(dataset)
+        fingerprint_columns = sorted({column for grouping in self.groupings for column in grouping} | {"Year", "Count"})
+        row_hashes = pd.util.hash_pandas_object(df[fingerprint_columns], index=False).to_numpy()
+        years = df["Year"].to_numpy()
+        order = np.argsort(years, kind="stable")
+        starts = np.flatnonzero(np.r_[True, np.diff(years[order]) != 0])
+        year_values = years[order][starts]
+        fingerprints = np.add.reduceat(row_hashes[order], starts) # the sum of the row hashes does not depend on the order of the rows
+        year_fingerprints = {str(year): format(fingerprint, "016x") for year, fingerprint in zip(year_values, fingerprints)}
+        changed_years = [year for year, fingerprint in year_fingerprints.items() if self.manifest["years"].get(year) != fingerprint]
+
+        if changed_years:
+            changed_rows = df[df["Year"].isin([int(year) for year in changed_years])]
+            generation = 0 if self.manifest["generation"] is None else self.manifest["generation"] + 1
+            for grouping in self.groupings:
+                year_partials = changed_rows.groupby(["Year"] + grouping, observed=True)["Count"].sum().astype(np.int64) # partial aggregates of the changed years only
+                parts = [] if self.manifest["generation"] is None else [self.totals(grouping)]
+                for year in changed_years:
+                    year_partial = year_partials.xs(int(year), level="Year")
+                    _write_aggregate(year_partial, self._year_dir(year, year_fingerprints[year], grouping))
+                    parts.append(year_partial)
+                    if year in self.manifest["years"]: # a changed year, its old contribution is taken out of the totals
+                        parts.append(-_read_aggregate(self._year_dir(year, self.manifest["years"][year], grouping), grouping))
+                totals = pd.concat(parts).groupby(level=list(range(len(grouping))), observed=True).sum()
+                totals = totals[totals != 0] # groups whose only rows were in a replaced year
+                _write_aggregate(totals, self._totals_dir(generation, grouping))
+                self._totals[tuple(grouping)] = totals
+
+            replaced_years = [f"{year}_{self.manifest['years'][year]}" for year in changed_years if year in self.manifest["years"]]
+            previous_generation = self.manifest["generation"]
+            self.manifest["years"].update({year: year_fingerprints[year] for year in changed_years})
+            self.manifest["generation"] = generation
+
+        if source_key is not None:
+            self.manifest["sources"].append(source_key)
+        self._write_manifest()
+
+        if changed_years: # the old files are removed only once the new manifest is in place
+            if previous_generation is not None:
+                shutil.rmtree(os.path.join(self.store_dir, f"totals_{previous_generation}"), ignore_errors=True)
+            for year_dir in replaced_years:
+                shutil.rmtree(os.path.join(self.store_dir, "years", year_dir), ignore_errors=True)
+        return [int(year) for year in changed_years]
+
+    def _write_manifest(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = os.path.join(self.store_dir, "manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, os.path.join(self.store_dir, "manifest.json"))
+
+def open_rollup_store(store_dir, dataset = 'National'):
+    """
+    This function opens (or creates) the RollupStore of the NationalNames or StateNames dataset with the aggregates used by the analysis functions.
+
+    Parameters:
+    store_dir - directory of the store
+    dataset - either 'National' or 'State', selects the kept aggregates from ROLLUP_GROUPINGS
+    """
+    if dataset not in ROLLUP_GROUPINGS:
+        raise ValueError("Invalid value. The 'dataset' expects input to be 'National' or 'State'.")
+    return RollupStore(store_dir, ROLLUP_GROUPINGS[dataset])
+
+@profiled("analysis")
 def check_year_span(file_path, dataset_name):
     """
     This function loads a text file of the chosen dataset and prints the range of recorded years.
     Parameters:
-    file_path - path to the dataset
+    file_path - path to the dataset, or the dataset already loaded by 'load_dataset'
     dataset_name - just for the printing purposes, the name of the dataset
     """
-    df = pd.read_csv(file_path)
+    df = load_dataset(file_path)
     min_year = df["Year"].min()
     max_year = df["Year"].max()
     print ()
     #print(f"Dataset: {file_path}")
     print(f"Year span of dataset {dataset_name}: {min_year} - {max_year}\n")
 
+def _period_statistics(name_count_per_year, name_peak_per_year, start_year, end_year):
+    """
+    This function computes the statistics printed by 'average_occurrence_in_time_period_national' from the yearly counts of one name
+    and the largest single record of every year (see 'NameSeriesIndex.peak_series'), which share the same years.
+    Returns the average occurance per year, the maximum yearly occurance and the year of the maximum (None if the name has no record in the period).
+    """
+    years = name_count_per_year.index.to_numpy()
+    counts = name_count_per_year.to_numpy()
+    first, last = np.searchsorted(years, [start_year, end_year + 1]) # the years are sorted, so the period is a contiguous slice
+    period_counts = counts[first:last]
+    period_peaks = name_peak_per_year.to_numpy()[first:last]
+    total_occurrences = period_counts.sum() # calculates the total number of babies born with the input name in the period between start_year and end_year
+    num_years = end_year - start_year + 1 # calculates the number of years in the period specified by start_year and end_year
+    average_occurance = total_occurrences / num_years if num_years > 0 else 0 # calculates the average occurance of newborns per year in the desired time period
+
+    if len(period_counts) > 0:
+        peak = period_peaks.argmax() # position of the year with the highest count of newborns in the given time period, the earliest one if more years share it
+        max_yearly_occurrence = period_peaks[peak] # the largest number of newborns with the given name in the given time period in a year, of one gender as in a single row of the dataset
+        max_year = years[first + peak] # the year in which the peak occurance was recorded
+    else:
+        max_yearly_occurrence = 0
+        max_year = None  # if there is no maximum year recorded
+
+    return average_occurance, max_yearly_occurrence, max_year
+
+@profiled("analysis")
 def average_occurrence_in_time_period_national(path_to_NationalNames_dataset, name, start_year, end_year):
     """
     This function calculates the average number of newborns (average occurance) and the maximum number of newborns in one year 
-    for a given period of years defined by the start_year and the end_year in the national dataset
+    for a given period of years defined by the start_year and the end_year in the national dataset.
+    The yearly counts are read from the name index (see 'load_name_index'), the average is over both genders,
+    the maximum is the largest single record of the dataset, i.e. of one gender in one year.
 
     It has 4 arameters:
-    file_path - path to the dataset
+    file_path - path to the dataset, or the dataset already loaded by 'load_dataset'
     name - the newborn name of interest
     start_year - the year from which we want to start monitoring the period of interest
     end_year - the last year for which we want to monitor the period of interest
     """
-    df = pd.read_csv(path_to_NationalNames_dataset)
-    df_filtered = df[(df["Name"] == name) & (df["Year"] >= start_year) & (df["Year"] <= end_year)] # filters only the data of the input name between the start_year and end_year
-    total_occurrences = df_filtered["Count"].sum() # calculates the total number of babies born with the input name in the period between start_year and end_year
-    num_years = end_year - start_year + 1 # calculates the number of years in the period specified by start_year and end_year
-    average_occurance = total_occurrences / num_years if num_years > 0 else 0 # calculates the average occurance of newborns per year in the desired time period
-
-    if not df_filtered.empty:
-        max_row = df_filtered.loc[df_filtered["Count"].idxmax()] # id of the row with the year of the highest count of newborns in the given time period
-        max_yearly_occurrence = max_row["Count"] # the largest number of newborns with the given name in the given time period in a year
-        max_year = max_row["Year"] # the year in which the peak occurance was recorded
-    else:
-        max_yearly_occurrence = 0
-        max_year = None  # if there is no maximum year recorded
+    name_index = load_name_index(path_to_NationalNames_dataset)
+    average_occurance, max_yearly_occurrence, max_year = _period_statistics(name_index.series(name), name_index.peak_series(name), start_year, end_year)
 
     print(f"Average yearly occurrence of '{name}' from {start_year} to {end_year} is {average_occurance:.2f}")
     print(f"Maximum yearly occurrence of '{name}' in this period is {max_yearly_occurrence} (occurred in {max_year})")
 
+@profiled("analysis")
+def average_occurrence_in_time_period_national_batch(path_to_NationalNames_dataset, names, start_year, end_year):
+    """
+    Batch variant of 'average_occurrence_in_time_period_national' for a list of names and one period of years.
+    All names are answered in one vectorized call of the range query engine (see 'load_range_query_engine').
+    It prints and returns a pandas DataFrame with the columns Name, Average_Occurrence, Max_Yearly_Occurrence and Max_Year.
+    """
+    engine = load_range_query_engine(path_to_NationalNames_dataset)
+    period_statistics = engine.query(names, start_year, end_year)[["Name", "Average_Occurrence", "Max_Yearly_Occurrence", "Max_Year"]]
+
+    print(period_statistics)
+    return period_statistics
+
+@profiled("analysis")
 def plot_name_occurance_change_over_time(path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", 
                                          path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
                                          name = 'Ida', 
@@ -68,52 +1033,277 @@ def plot_name_occurance_change_over_time(path_to_NationalNames_dataset = r"C:\Us
             NC, ND, NE, NH, NJ, NM, NV, NY, OH, OK, OR, PA, RI, SC, SD, TN, TX, UT, VA, VT, WA, WI, WV, WY.
             Or a None input if we do not want to narrow the statistics for a single state.
     """
-    if dataset == 'National':
-        file_path_NationalNames = path_to_NationalNames_dataset
-        df_NationalNames = pd.read_csv(file_path_NationalNames)
+    name_count_per_year, title = lookup_name_count_per_year(path_to_NationalNames_dataset, path_to_StateNames_dataset, name, dataset, state)
+    render_plots([(plot_name_count_per_year, {"name_count_per_year": name_count_per_year, "title": title, "save_path": os.path.join(path_to_results, f"{plotname_to_save}.png")})])
 
-    if dataset == 'State':
-        file_path_StateNames = path_to_StateNames_dataset
-        df_StateNames = pd.read_csv(file_path_StateNames)
+def init_render_process(profile_path):
+    """
+    Initializer of the processes rendering plots (see 'render_plots'), it switches them to the Agg backend and passes them the profiling setting.
+    """
+    plt.switch_backend("Agg") # non-interactive backend, the worker processes only save the plots
+    if profile_path is not None: # the profiling set by 'enable_profiling' is not inherited by processes started by re-importing this module
+        enable_profiling(profile_path)
 
-    plt.figure(figsize=(10, 6))
+def _render_plot(job):
+    plot_function, arguments = job
+    with profile_span("render", os.path.basename(arguments.get("save_path", plot_function.__name__))):
+        plot_function(**arguments)
 
-    if dataset == 'National':
-        name_occurances = df_NationalNames[df_NationalNames["Name"] == name] # selecting all occurances of the chosen name
-        name_count_per_year = name_occurances.groupby("Year")["Count"].sum() # counting for each year how many times the chosen name was given to a baby
-        plt.title('Occurrences of the name %s over the years' % (name), fontsize=14)
+def render_plots(jobs, render_processes=None):
+    """
+    This function renders and saves a list of plots, either one after another or on a pool of processes.
 
+    Parameters:
+    jobs - list of (plot_function, arguments) pairs, every plot is drawn by plot_function(**arguments).
+           plot_function has to be a module-level function (so it can be sent to a process) and the arguments should contain only the data of that one plot,
+           e.g. the pre-sliced yearly counts of one name, never the whole dataset.
+    render_processes - None renders the plots in this process (the default, as before),
+                       a number renders them on that many processes with the non-interactive Agg backend, e.g. os.cpu_count() to use all cores.
+                       On Windows, processes are started by re-importing the main script, so a script using this has to call it under if __name__ == "__main__":
+    """
+    if render_processes is None:
+        for job in jobs:
+            _render_plot(job)
+            print ('The plot has been saved in the folder Results \n')
+        return
 
-    if dataset == 'State':
+    with ProcessPoolExecutor(max_workers=render_processes, initializer=init_render_process, initargs=(PROFILE_PATH,)) as executor:
+        for _ in executor.map(_render_plot, jobs):
+            print ('The plot has been saved in the folder Results \n')
+
+@profiled("analysis")
+def plot_name_occurance_change_over_time_jobs(path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", 
+                                              path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
+                                              jobs = (('Ida', 'State', 'CA', 'Ida_change_over_time_state_CA'),), 
+                                              path_to_results = r"C:\Users\matej\VSCode_projects\STRV_test_project\STRV_test_project\Results", 
+                                              render_processes = None
+                                              ):
+    """
+    Batch variant of 'plot_name_occurance_change_over_time' for any mix of names, datasets and states.
+
+    Parameters:
+    jobs - list of (name, dataset, state, plotname_to_save) tuples, with the same meaning as the parameters of 'plot_name_occurance_change_over_time',
+           so every plot is saved under the same file name as it would be by a single call
+    render_processes - number of processes rendering the plots, None to render them in this process (see 'render_plots')
+
+    The yearly counts of every job are looked up in the name indexes here, only these short series are sent to the rendering processes.
+    """
+    render_jobs = []
+    for name, dataset, state, plotname_to_save in jobs:
+        name_count_per_year, title = lookup_name_count_per_year(path_to_NationalNames_dataset, path_to_StateNames_dataset, name, dataset, state)
+        render_jobs.append((plot_name_count_per_year, {"name_count_per_year": name_count_per_year, "title": title, "save_path": os.path.join(path_to_results, f"{plotname_to_save}.png")}))
+    render_plots(render_jobs, render_processes)
+
+@profiled("analysis")
+def plot_name_occurance_change_over_time_batch(path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", 
+                                               path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
+                                               names = ('Ida',), 
+                                               dataset = 'State', 
+                                               state = 'CA', 
+                                               path_to_results = r"C:\Users\matej\VSCode_projects\STRV_test_project\STRV_test_project\Results", 
+                                               plotname_to_save = '{name}_change_over_time_state_{state}', 
+                                               render_processes = None
+                                               ):
+    """
+    Batch variant of 'plot_name_occurance_change_over_time' for a list of names, all from the same dataset and state.
+    The dataset and its name index are loaded once for all names.
+
+    The parameter plotname_to_save is a template, '{name}' and '{state}' in it are replaced by the name and the state of each plot.
+    The parameter render_processes is the number of processes rendering the plots, None to render them in this process (see 'render_plots').
+    """
+    jobs = [(name, dataset, state, plotname_to_save.format(name=name, state=state)) for name in names]
+    plot_name_occurance_change_over_time_jobs(path_to_NationalNames_dataset, path_to_StateNames_dataset, jobs, path_to_results, render_processes)
+
+def lookup_name_count_per_year(path_to_NationalNames_dataset, path_to_StateNames_dataset, name, dataset, state):
+    """
+    This function looks up the yearly counts of a name for 'plot_name_occurance_change_over_time' in the name index of the chosen dataset.
+    Returns the counts as a pandas Series indexed by year and the title of the plot.
+    """
+    if dataset == 'National':
+        name_count_per_year = load_name_index(path_to_NationalNames_dataset).series(name) # counting for each year how many times the chosen name was given to a baby
+        title = 'Occurrences of the name %s over the years' % (name)
+
+    elif dataset == 'State':
         if state is None:
-            name_occurances = df_StateNames[df_StateNames["Name"] == name] # selecting all occurances of the chosen name
-            name_count_per_year = name_occurances.groupby("Year")["Count"].sum() # counting for each year how many times the chosen name was given to a baby
-            plt.title('Occurrences of the name %s over the years' % (name), fontsize=14)
+            name_count_per_year = load_name_index(path_to_StateNames_dataset).series(name) # counting for each year how many times the chosen name was given to a baby
+            title = 'Occurrences of the name %s over the years' % (name)
+        else:
+            name_count_per_year = load_name_index(path_to_StateNames_dataset, by_state=True).series(name, state) # counting for each year how many times the chosen name in the chosen state was given to a baby
+            title = 'Occurrences of the name %s over the years in the state %s' % (name, state)
 
-        if state != None:    
-            name_occurances = df_StateNames[(df_StateNames["Name"] == name) & (df_StateNames["State"] == state)] # selecting all occurances of the chosen name in the chosen state
-            name_count_per_year = name_occurances.groupby("Year")["Count"].sum() # counting for each year how many times the chosen name in the chosen state was given to a baby
-            plt.title('Occurrences of the name %s over the years in the state %s' % (name, state), fontsize=14)
+    else:
+        raise ValueError("Invalid value. The 'dataset' expects input to be 'National' or 'State'.")
 
-    
+    return name_count_per_year, title
+
+def plot_name_count_per_year(name_count_per_year, title, save_path):
+    """
+    This function draws the bar plot of 'plot_name_occurance_change_over_time' from the yearly counts of 'lookup_name_count_per_year' and saves it to save_path (a path or a file object).
+    """
+    plt.figure(figsize=(10, 6))
+    plt.title(title, fontsize=14)
     plt.bar(name_count_per_year.index, name_count_per_year.values, color='lightblue', edgecolor='black')
     plt.xlabel('Year', fontsize=12)
     plt.ylabel('Number of Occurrences', fontsize=12)
     plt.xticks(ticks=range(min(name_count_per_year.index), max(name_count_per_year.index)+1, 10), rotation=45) # X-axis showing years per decade, rotated by 45 degrees
     # it starts either at the first year of the national dataset, 1880 or the first year of the state dataset, which is 1910
     plt.tight_layout()
-    save_path = os.path.join(path_to_results, f"{plotname_to_save}.png")
     plt.savefig(save_path, dpi=300, bbox_inches="tight")
-    print ('The plot has been saved in the folder Results \n')
     plt.close() 
-    
 
+_loaded_unisex_name_samplers = {} # unisex name samplers already built in this process, keyed by the (Name, Gender) aggregate they were built from
+
+class UnisexNameSampler:
+    """
+    This class draws random unisex names, as 'random_most_unisex_name' does, without recomputing anything per draw.
+
+    When it is created, it computes once for all names the female and male counts F and M, Total = F + M and Unisex_score = min(F, M) / max(F, M),
+    keeps only the names given to both genders and stores them in two orders:
+    - by Total and Unisex_score, descending, which is the order in which 'random_most_unisex_name' prints the names
+    - by Unisex_score, descending, so the names above any minimum_unisex_score are found by a binary search
+    The selection for a pair of thresholds is then computed once and cached, and every draw from it costs O(1):
+    a uniform draw picks a random position, a draw weighted by Total uses the alias method built once per selection.
+    Only the selections and alias tables of the last SELECTION_CACHE_SIZE pairs of thresholds are kept, so a long-running service asked
+    for many different thresholds does not grow without bound.
+
+    It is created by 'load_unisex_name_sampler'.
+    """
+    SELECTION_CACHE_SIZE = 64
+
+    def __init__(self, name_gender_totals):
+        name_gender_counts = name_gender_totals.unstack(fill_value=0) # makes a 2 column table, name of the baby, female count, male count
+        name_gender_counts["Total"] = name_gender_counts["M"] + name_gender_counts["F"] # computes the total number of names, of each gender and adds as a new column to the 2 column table created above
+        name_gender_counts["Unisex_score"] = name_gender_counts[["M", "F"]].min(axis=1) / name_gender_counts[["M", "F"]].max(axis=1) # finds for each pair of female and male occurances per name their minimum and maximum value and calculates their ratio.
+        name_gender_counts = name_gender_counts[(name_gender_counts["M"] > 0) & (name_gender_counts["F"] > 0)]
+
+        self.table = name_gender_counts.sort_values(by=["Total", "Unisex_score"], ascending=[False, False], kind="stable") # every selection keeps this order
+        self.names = np.asarray(self.table.index, dtype=object)
+        self.totals = self.table["Total"].to_numpy()
+        scores = self.table["Unisex_score"].to_numpy()
+        self._by_score = np.argsort(-scores, kind="stable") # positions in self.table, from the most unisex name
+        self._negative_scores_sorted = -scores[self._by_score] # ascending, for np.searchsorted
+        self._selections = collections.OrderedDict() # (minimum_unisex_score, minimum_name_count) -> positions in self.table, least recently used first
+        self._alias_tables = collections.OrderedDict() # (minimum_unisex_score, minimum_name_count) -> (probabilities, aliases), least recently used first
+        self._cache_lock = threading.Lock()
+
+    def _cached(self, cache, key, compute):
+        with self._cache_lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = compute() # outside of the lock, two threads may compute the same value, both results are equal
+        with self._cache_lock:
+            cache[key] = value
+            while len(cache) > self.SELECTION_CACHE_SIZE:
+                cache.popitem(last=False)
+        return value
+
+    def _selection(self, minimum_unisex_score, minimum_name_count):
+        def compute():
+            above_score = self._by_score[:np.searchsorted(self._negative_scores_sorted, -minimum_unisex_score, side="right")] # all names with Unisex_score >= minimum_unisex_score
+            return np.sort(above_score[self.totals[above_score] >= minimum_name_count])
+        return self._cached(self._selections, (minimum_unisex_score, minimum_name_count), compute)
+
+    def _alias_table(self, minimum_unisex_score, minimum_name_count):
+        def compute():
+            return _build_alias_table(self.totals[self._selection(minimum_unisex_score, minimum_name_count)])
+        return self._cached(self._alias_tables, (minimum_unisex_score, minimum_name_count), compute)
+
+    def unisex_names(self, minimum_unisex_score=0.9, minimum_name_count=3000):
+        """
+        Returns the table of the names with Unisex_score >= minimum_unisex_score and Total >= minimum_name_count,
+        with the columns F, M, Total and Unisex_score, sorted by Total and Unisex_score, descending.
+        """
+        return self.table.iloc[self._selection(minimum_unisex_score, minimum_name_count)]
+
+    def sample(self, k=None, minimum_unisex_score=0.9, minimum_name_count=3000, weighted=False, rng=None):
+        """
+        Draws random names from the names selected by the thresholds.
+
+        Parameters:
+        k - None to draw a single name (returned as a string), or the number of names to draw at once (returned as a NumPy array, drawn with replacement)
+        minimum_unisex_score, minimum_name_count - the same thresholds as in 'random_most_unisex_name'
+        weighted - if False, every selected name is equally likely, if True, names are drawn with probability proportional to their Total count
+        rng - a numpy.random.Generator, if None a single name is drawn with the 'random' module (the same draw as random.choice, so random.seed applies)
+              and several names with a new numpy.random.default_rng()
+        """
+        selection = self._selection(minimum_unisex_score, minimum_name_count)
+        if len(selection) == 0:
+            raise ValueError("No name passes the 'minimum_unisex_score' and 'minimum_name_count' thresholds.")
+        if weighted:
+            probabilities, aliases = self._alias_table(minimum_unisex_score, minimum_name_count)
+
+        if k is None and rng is None:
+            column = random.randrange(len(selection))
+            if weighted and random.random() >= probabilities[column]:
+                column = aliases[column]
+            return self.names[selection[column]]
+
+        if rng is None:
+            rng = np.random.default_rng()
+        columns = rng.integers(len(selection), size=1 if k is None else k)
+        if weighted:
+            columns = np.where(rng.random(len(columns)) < probabilities[columns], columns, aliases[columns])
+        names = self.names[selection[columns]]
+        return names[0] if k is None else names
+
+def _build_alias_table(weights):
+    """
+    This function builds the table of the alias method for drawing position i with probability weights[i] / weights.sum():
+    draw a column uniformly, keep it with probability probabilities[column], otherwise take aliases[column].
+
+    It is Walker's construction with the columns of scaled weight >= 1 ("large") consumed one after the other,
+    which makes every assignment a cumulative sum and a binary search instead of a loop over the names:
+    the small columns, in order, take the rest of their unit from the current large column, a large column stays current until its
+    cumulative excess (scaled weight - 1) is used up and then becomes a small column taking the rest of its unit from the next large one.
+    """
+    number_of_names = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * number_of_names / np.sum(weights) # average 1, a column with scaled < 1 borrows the rest from its alias
+    probabilities = np.ones(number_of_names)
+    aliases = np.arange(number_of_names)
+    small = np.flatnonzero(scaled < 1)
+    large = np.flatnonzero(scaled >= 1)
+    if len(small) == 0 or len(large) == 0:
+        return probabilities, aliases
+
+    deficits = np.cumsum(1 - scaled[small]) # taken from the large columns by the small ones up to and including each small one
+    excesses = np.cumsum(scaled[large] - 1) # given by the large columns up to and including each large one
+    current_large = np.minimum(np.searchsorted(excesses, np.r_[0, deficits[:-1]], side="left"), len(large) - 1) # the large column current when each small one is reached
+    probabilities[small] = scaled[small]
+    aliases[small] = large[current_large]
+
+    used_up = np.searchsorted(deficits, excesses[:-1], side="right") # the small column by which each large one (but the last) is used up
+    passed = used_up < len(small) # the others keep probability 1, as the rounding leftovers
+    probabilities[large[:-1][passed]] = np.clip(1 + excesses[:-1][passed] - deficits[used_up[passed]], 0, 1)
+    aliases[large[:-1][passed]] = large[1:][passed]
+    return probabilities, aliases
+
+def load_unisex_name_sampler(dataset, chunk_size=None):
+    """
+    This function returns the UnisexNameSampler of a dataset, built from its (Name, Gender) aggregate the first time it is needed.
+
+    Parameters:
+    dataset - path to the NationalNames/StateNames CSV file, or a DataFrame returned by 'load_dataset'
+    chunk_size - if set, the aggregate is computed by streaming the CSV file in chunks of this many rows (see 'aggregate_counts')
+    """
+    [name_gender_totals] = aggregate_counts(dataset, [["Name", "Gender"]], chunk_size)
+    memo_key = id(name_gender_totals)
+    with _memo_lock(("unisex_name_sampler", memo_key)):
+        if memo_key in _loaded_unisex_name_samplers and _loaded_unisex_name_samplers[memo_key][0]() is name_gender_totals:
+            return _loaded_unisex_name_samplers[memo_key][1]
+        with profile_span("model", "build UnisexNameSampler", rows=len(name_gender_totals)):
+            sampler = UnisexNameSampler(name_gender_totals)
+        _loaded_unisex_name_samplers[memo_key] = (weakref.ref(name_gender_totals), sampler)
+        return sampler
+
+@profiled("analysis")
 def random_most_unisex_name(path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", 
                             path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
                             dataset = 'National', 
                             minimum_unisex_score = 0.9, 
                             minimum_name_count = 3000, 
-                            printing_the_names = True
+                            printing_the_names = True, 
+                            chunk_size = None
                             ):
     """
     This function calculates the unisexness of names, the unisex_score, U = min(F, M) / max(F, M), 
@@ -121,10 +1311,12 @@ def random_most_unisex_name(path_to_NationalNames_dataset = r"C:\Users\matej\.ca
     U is a float number between 1 (most unisex name, F = M) and 0.
 
     This function has following 4 parameters:
-    dataset - chooosing which dataset we work with, either 'National' or 'State'
+    dataset - chooosing which dataset we work with, either 'National' or 'State'. The datasets are given by path_to_NationalNames_dataset and path_to_StateNames_dataset,
+              each one a path, a dataset already loaded by 'load_dataset', or its RollupStore (see 'open_rollup_store')
     minimum_unisex_score - parameter defining the minimum unisex_score, to screen out names of low unisex_score
     minimum_name_count - parameter defining the minimum number of TOTAL names assigned for the baby. It is used to filter out low occuring names
     printing_the_names - if set to True, it prints the resulted filtered unisex names based on our input parameters
+    chunk_size - if set, the dataset is streamed in chunks of this many rows instead of being loaded whole into memory (see 'aggregate_counts')
 
     The function prints the list of names with U > minimum_unisex_score and count of newborn > minimum_name_count if the parameter printing_the_names == True.
     --> this is used for the project's task to find the most unisex name
@@ -134,35 +1326,28 @@ def random_most_unisex_name(path_to_NationalNames_dataset = r"C:\Users\matej\.ca
     """
     
     if dataset == 'National':
-        df_Names = pd.read_csv(path_to_NationalNames_dataset)
+        path_to_Names_dataset = path_to_NationalNames_dataset
 
     if dataset == 'State':
-        df_Names = pd.read_csv(path_to_StateNames_dataset)
+        path_to_Names_dataset = path_to_StateNames_dataset
 
-    name_gender_counts = df_Names.groupby(["Name", "Gender"])["Count"].sum().unstack(fill_value=0) # makes a 2 column table, name of the baby, female count, male count
-    name_gender_counts["Total"] = name_gender_counts["M"] + name_gender_counts["F"] # computes the total number of names, of each gender and adds as a new column to the 2 column table created above
-    name_gender_counts["Unisex_score"] = name_gender_counts[["M", "F"]].min(axis=1) / name_gender_counts[["M", "F"]].max(axis=1) # finds for each pair of female and male occurances per name their minimum and maximum value and calculates their ratio.
-    
-    unisex_names = name_gender_counts[
-        (name_gender_counts["M"] > 0) & 
-        (name_gender_counts["F"] > 0) & 
-        (name_gender_counts["Unisex_score"] >= minimum_unisex_score) & 
-        (name_gender_counts["Total"] >= minimum_name_count)
-    ] # filters only names within defined tresholds
-
-    unisex_names_sorted = unisex_names.sort_values(by=["Total", "Unisex_score"], ascending=[False, False]) # sorts the selected list by the total number of names (count) and for the names with the same count by the Unisex_score
+    sampler = load_unisex_name_sampler(path_to_Names_dataset, chunk_size)
+    unisex_names_sorted = sampler.unisex_names(minimum_unisex_score, minimum_name_count) # names within defined tresholds, sorted by the total number of names (count) and for the names with the same count by the Unisex_score
     if printing_the_names == True:
         print(unisex_names_sorted)
     print ('The most Unisex name is', unisex_names_sorted.index[0])
-    random_name = random.choice(unisex_names_sorted.index.tolist())
+    random_name = sampler.sample(minimum_unisex_score=minimum_unisex_score, minimum_name_count=minimum_name_count)
     return (random_name)
 
+@profiled("analysis")
 def find_common_national_rare_state(path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", 
                                     path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
                                     threshold_national = 0.7, 
                                     threshold_state = 0.4, 
                                     sort_by = 'National', 
-                                    keep_only_the_lowest_state_per_name = False
+                                    keep_only_the_lowest_state_per_name = False, 
+                                    chunk_size = None, 
+                                    processes = None
                                     ):
     """
     This function finds the most common national names that are also rare at the state level.
@@ -170,27 +1355,33 @@ def find_common_national_rare_state(path_to_NationalNames_dataset = r"C:\Users\m
     and at the same time lower in their relative occurance on the state level than the 'threshold_state'.
 
     Parameters of the function:
-    path_to_NationalNames_dataset - path to the NationalNames dataset
-    path_to_StateNames_dataset - path to the StateNames dataset
+    path_to_NationalNames_dataset - path to the NationalNames dataset, the dataset already loaded by 'load_dataset', or its RollupStore (see 'open_rollup_store')
+    path_to_StateNames_dataset - path to the StateNames dataset, the dataset already loaded by 'load_dataset', or its RollupStore (see 'open_rollup_store')
     threshold_national - threshold for filtering names which have relative commonness (*) higher than this value on the national level 
     threshold_state - threshold to filter names which have relative commonnes on the state level smaller than this value
     sort_by - either 'National' or 'State', defines by which relative comonness should the output list of names be sorted
     keep_only_the_lowest_state_per_name - a True or False parameter, if True, it will keep each name in the list only once, with its lowest record in the relative comonness on the state level
                                                                      if False, it will keep all state entries where the name scored relative comonness on the state level lower than the threshold_state
+    chunk_size - if set, both datasets are streamed in chunks of this many rows instead of being loaded whole into memory (see 'aggregate_counts')
+    processes - if set, the StateNames dataset is partitioned by state and the state summary (totals, maximum and relative commonness of every name)
+                is computed on this many processes (see '_map_states'), only the merge with the national summary and the filtering run in this process
 
     (*) relative comonness is defined as a ratio of all name counts with respect to the most occuring name, its value is thus between 1 and 0, where 1 is the most occuring name. 
     This is calculated for national dataset and stored in the column 'Relative_Commonness_National' and separately also for state dataset per state stored in 'Relative_Commonness_State'
     """
     
-    df_national = pd.read_csv(path_to_NationalNames_dataset)
-    df_national_summary = df_national.groupby("Name")[["Count"]].sum().reset_index() # groups dataset by name and sums all counts of each name, converts back to a pandas dataframe
+    [national_totals] = aggregate_counts(path_to_NationalNames_dataset, [["Name"]], chunk_size)
+    df_national_summary = national_totals.reset_index() # groups dataset by name and sums all counts of each name, converts back to a pandas dataframe
     max_count = df_national_summary["Count"].max() # finds the largest value in the count column --> corresponding to the most common name on national level
     df_national_summary["Relative_Commonness_National"] = (df_national_summary["Count"] / max_count) # for each name, calculates the ratio of its total count on national level over all years with the largest count of the most occuring name
     
-    df_state = pd.read_csv(path_to_StateNames_dataset)
-    df_state_summary = df_state.groupby(["State", "Name"])["Count"].sum().reset_index() # groups dataset by state and name, sums all counts over years for the same name in a particular state, reset_index converts back to pd.df
-    df_state_summary["Max_Count_State"] = df_state_summary.groupby("State")["Count"].transform("max") # groups dataset by state, finds the largest value in the count column for each state and stores it as a new column --> the most common name per state
-    df_state_summary["Relative_Commonness_State"] = df_state_summary["Count"] / df_state_summary["Max_Count_State"] # creates a new column "Relative_Commonness_State" which is the ratio of a name's count to the most common name's count in that particular state
+    if _uses_state_processes(path_to_StateNames_dataset, chunk_size, processes):
+        [df_state_summary] = _map_states(path_to_StateNames_dataset, processes, _state_name_commonness)
+    else:
+        [state_name_totals] = aggregate_counts(path_to_StateNames_dataset, [["State", "Name"]], chunk_size)
+        df_state_summary = state_name_totals.reset_index() # groups dataset by state and name, sums all counts over years for the same name in a particular state, reset_index converts back to pd.df
+        df_state_summary["Max_Count_State"] = df_state_summary.groupby("State", observed=True)["Count"].transform("max") # groups dataset by state, finds the largest value in the count column for each state and stores it as a new column --> the most common name per state
+        df_state_summary["Relative_Commonness_State"] = df_state_summary["Count"] / df_state_summary["Max_Count_State"] # creates a new column "Relative_Commonness_State" which is the ratio of a name's count to the most common name's count in that particular state
 
     df_final = df_state_summary.merge(df_national_summary, on="Name", how="left", suffixes=("_State", "_National")) # putting the national and state data together so the statistics can be compared
 
@@ -198,7 +1389,7 @@ def find_common_national_rare_state(path_to_NationalNames_dataset = r"C:\Users\m
                                           (df_final["Relative_Commonness_State"] <= threshold_state)] # filters only names BELOW the treshold_state
 
     if keep_only_the_lowest_state_per_name == True: # If we want to monitor each name uniquely, so they do not repeat if low in multiple states and instead keeping only their lowest state
-        common_national_rare_state = common_national_rare_state.loc[common_national_rare_state.groupby("Name")["Relative_Commonness_State"].idxmin()]
+        common_national_rare_state = common_national_rare_state.loc[common_national_rare_state.groupby("Name", observed=True)["Relative_Commonness_State"].idxmin()]
 
     if sort_by == 'National': # if we want to sort the output by the "Relative_Commonness_National"
         common_national_rare_state_sorted = common_national_rare_state.sort_values(by='Relative_Commonness_National', ascending=False).reset_index(drop=True) # ascending false because for sorting by national level I am interested in the most common nationally
@@ -209,122 +1400,495 @@ def find_common_national_rare_state(path_to_NationalNames_dataset = r"C:\Users\m
     
     print(common_national_rare_state_sorted[['Name', 'Relative_Commonness_National', 'Relative_Commonness_State', 'State']])
 
+def _state_name_commonness(partition):
+    """
+    The state summary of 'find_common_national_rare_state' for the rows of one state, computed by a worker process of '_map_states'.
+    """
+    state_summary = _state_totals(partition, ["State", "Name"])
+    state_summary["Max_Count_State"] = state_summary["Count"].max() # a single state, its most common name
+    state_summary["Relative_Commonness_State"] = state_summary["Count"] / state_summary["Max_Count_State"]
+    return [state_summary]
+
+@profiled("model")
+def fit_name_trends(name_year_counts):
+    """
+    This function fits a linear regression Count = Intercept + Trend_Slope * Year for every name at once.
+    Instead of fitting one model per name, it computes the least-squares solution from grouped sums over NumPy arrays:
+    Trend_Slope = Sxy / Sxx, where Sxx and Sxy are the per-name sums of (x - mean_x)^2 and (x - mean_x)(y - mean_y).
+    The sums are taken around the per-name means, which gives the same slopes as sklearn's LinearRegression without losing precision on year values around 2000.
+
+    Parameter:
+    name_year_counts - pandas DataFrame with the columns 'Name', 'Year' and 'Count', one row per name and year
+
+    Returns a pandas DataFrame sorted by name with the columns:
+    Name, Trend_Slope, Intercept, R2 (coefficient of determination of the fit) and Points (number of years used for the fit).
+    Names with less than 2 data points are left out, lin.reg. needs at least 2 data points for fitting.
+    """
+    codes, names = pd.factorize(name_year_counts["Name"], sort=True) # integer id of the name for every row
+    x = name_year_counts["Year"].to_numpy(dtype=np.float64)
+    y = name_year_counts["Count"].to_numpy(dtype=np.float64)
+    number_of_names = len(names)
+
+    points = np.bincount(codes, minlength=number_of_names) # number of years recorded for each name
+    mean_x = np.bincount(codes, weights=x, minlength=number_of_names) / points
+    mean_y = np.bincount(codes, weights=y, minlength=number_of_names) / points
+    dx = x - mean_x[codes]
+    dy = y - mean_y[codes]
+    sxx = np.bincount(codes, weights=dx * dx, minlength=number_of_names)
+    sxy = np.bincount(codes, weights=dx * dy, minlength=number_of_names)
+    syy = np.bincount(codes, weights=dy * dy, minlength=number_of_names)
+
+    with np.errstate(divide="ignore", invalid="ignore"): # names with a single data point give 0/0, they are dropped below
+        slope = sxy / sxx
+        r2 = np.where(syy > 0, sxy * sxy / (sxx * syy), 1.0) # a constant count is fitted perfectly
+    intercept = mean_y - slope * mean_x
+
+    trends = pd.DataFrame({"Name": names, "Trend_Slope": slope, "Intercept": intercept, "R2": r2, "Points": points})
+    return trends[trends["Points"] >= 2].reset_index(drop=True)
+
+def _plot_trend(name, X, y, intercept, trend_slope, years_to_analyze, save_path):
+    X_pred = np.arange(X.min(), X.max() + 1)
+    y_pred = intercept + trend_slope * X_pred # predicting the lin.reg. trend
+
+    plt.figure(figsize=(8, 5))
+    plt.scatter(X, y, color="blue", label="Count", alpha=0.6)
+    plt.plot(X_pred, y_pred, color="red", linestyle="-", label="Linear regression", linewidth=1)
+    plt.xticks(np.arange(X.min(), X.max() + 1, 1))  # plotting only int. years, not floats
+    plt.xlabel("Year")
+    plt.ylabel("Count")
+    plt.title(f"Trend for {name} over the last {years_to_analyze} years")
+    plt.legend()
+    plt.savefig(save_path, dpi=300, bbox_inches="tight")
+    plt.close() 
+
+def plot_trending_names(name_year_counts, 
+                        trending_names, 
+                        years_to_analyze, 
+                        path_to_results = r"C:\Users\matej\VSCode_projects\STRV_test_project\STRV_test_project\Results", 
+                        plotname_to_save = 'trending_analysis', 
+                        render_processes = None
+                        ):
+    """
+    This function plots the counts of trending names in the analyzed years together with their lin.reg. fit, one plot per name, as 'find_trending_names_by_slope' does.
+
+    Parameters:
+    name_year_counts - pandas DataFrame with the columns 'Name', 'Year' and 'Count' of the analyzed years only
+    trending_names - pandas DataFrame with the columns 'Name', 'Trend_Slope' and 'Intercept', e.g. the top rows of the output of 'fit_name_trends'
+    years_to_analyze - number of analyzed years, used in the title and the file name of the plots
+    path_to_results - path for the directory to which the plots are saved
+    plotname_to_save - starting part of the name of plots for saving, the file names are the same as the ones of 'find_trending_names_by_slope'
+    render_processes - number of processes rendering the plots, None to render them in this process (see 'render_plots')
+    """
+    selected = name_year_counts[name_year_counts["Name"].isin(trending_names["Name"])]
+    name_groups = dict(iter(selected.groupby("Name", observed=True))) # slicing the data of all plotted names in one pass, each plot gets only its own rows
+    jobs = []
+    for trend in trending_names.itertuples(index=False):
+        name_data = name_groups[trend.Name]
+        save_path = os.path.join(path_to_results, f"{plotname_to_save}_for_past_{years_to_analyze}_years_slope_{trend.Trend_Slope:.0f}_{trend.Name}.png")
+        jobs.append((_plot_trend, {"name": trend.Name, 
+                                   "X": name_data["Year"].values, 
+                                   "y": name_data["Count"].values, 
+                                   "intercept": trend.Intercept, 
+                                   "trend_slope": trend.Trend_Slope, 
+                                   "years_to_analyze": years_to_analyze, 
+                                   "save_path": save_path}))
+    render_plots(jobs, render_processes)
+
+@profiled("analysis")
 def find_trending_names_by_slope(path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", 
                                  years_to_analyze=20, 
                                  plot_top_n = 10, 
                                  path_to_results = r"C:\Users\matej\VSCode_projects\STRV_test_project\STRV_test_project\Results", 
-                                 plotname_to_save = 'trending_analysis'
+                                 plotname_to_save = 'trending_analysis', 
+                                 render_processes = None
                                  ):
     """
     This function fits a linear regression model to measure the slope of change of number of newborns with a certain name over the last 'years_to_analyze' years.
     It is designed to find and print the top 10 trending names in this time period.
 
     Parameters:
-    path_to_NationalNames_dataset - path to the NationalNames dataset
+    path_to_NationalNames_dataset - path to the NationalNames dataset, or the dataset already loaded by 'load_dataset'
     years_to_analyze - number of years for which we calculate the slope of the trend. It starts from the most recent year.
     plot_top_n - the number off top trending names to plot, default for the task is 10
     path_to_results - path for the directory to which the function saves the plots of the 'plot_top_n' names with lin.reg. fit. X axis are the analyzed years, Y axis is the total count of the newborns with the baby name in a year
     plotname_to_save - starting part of the name of plots for saving, some results of the analysis are added after this starting string 
+    render_processes - number of processes rendering the plots, None to render them in this process (see 'render_plots')
     """
-    df_national = pd.read_csv(path_to_NationalNames_dataset)
+    [name_year_totals] = aggregate_counts(path_to_NationalNames_dataset, [["Name", "Year"]]) # total count of each name in each year across genders, the same aggregate the name index is built from
+    df_national = name_year_totals.reset_index()
     max_year = df_national["Year"].max() # the last year in the dataset
     min_year = max_year - years_to_analyze + 1  # earliest year to include in analysis
     recent_years = list(range(min_year, max_year + 1))  # the list of the years to analyze
 
-    df_filtered = df_national[df_national["Year"] >= min_year] # selecting only the last 'years_to_analyze' years
-    df_national = df_filtered.groupby(["Name", "Year"])["Count"].sum().reset_index() # total count of each name in each year across genders
-    recent_counts = df_national[df_national["Year"].isin(recent_years)].groupby("Name")["Count"].sum().reset_index() # calculating total occurance of each name in the entire analyzed period --> good for business needs of startup 
+    df_national = df_national[df_national["Year"] >= min_year].reset_index(drop=True) # selecting only the last 'years_to_analyze' years
+    recent_counts = df_national[df_national["Year"].isin(recent_years)].groupby("Name", observed=True)["Count"].sum().reset_index() # calculating total occurance of each name in the entire analyzed period --> good for business needs of startup 
     recent_counts.rename(columns={"Count": "Recent_Counts"}, inplace=True)
 
-    name_trends = [] # array for storing the steepness of slope after lin.reg. fitting
+    df_trends = fit_name_trends(df_national) # least-squares fit for all names at once, names with less than 2 data points are already left out
+    df_trends = df_trends[df_trends["Trend_Slope"] > 0] # filtering only the positive values of slope, getting rid of highly decreasing names over the insepcted period
+    df_trends = df_trends.merge(recent_counts, on="Name", how="left")
+    df_trends_sorted = df_trends.sort_values(by="Trend_Slope", ascending=False) # sorting by the steepness 
+    top_trending_names = df_trends_sorted.head(plot_top_n).reset_index(drop=True)
 
-    for name, group in df_national.groupby("Name"): # iterating through names
-        X = group["Year"].values.reshape(-1, 1)  # X values are  years, reshapen for sklearn
-        y = group["Count"].values # y values are counts
+    plot_trending_names(df_national, top_trending_names, years_to_analyze, path_to_results, plotname_to_save, render_processes)
 
-        if len(y) < 2:
-            continue  # lin.reg. needs at least 2 data points for fitting
+    print (top_trending_names[["Name", "Trend_Slope", "Recent_Counts"]])
 
-        model = LinearRegression() 
-        model.fit(X, y) # lin.reg. fitting
+_loaded_rolling_trend_scanners = {} # rolling trend scanners already built in this process, keyed by the name index they were built from
 
-        slope = model.coef_.flatten()[0]
+class RollingTrendScanner:
+    """
+    This class computes the trend slopes of 'find_trending_names_by_slope' for any window of years, not only for the window ending at the last year,
+    e.g. "what was trending in 1990 over the previous 5 years", for all names and many windows in one vectorized pass.
 
-        if slope > 0:  # filtering only the positive values of slope, getting rid of highly decreasing names over the insepcted period
-            name_trends.append({"Name": name, "Trend_Slope": slope})
+    It is built from a NameSeriesIndex and keeps, for every name, cumulative sums over the years of the five sums of a least-squares fit:
+    the number of recorded years n, x, x^2, y and x*y (x is the year counted from the first year of the dataset, y the count).
+    The sums over any window are differences of two cumulative sums, and Trend_Slope = (n*Sxy - Sx*Sy) / (n*Sxx - Sx^2),
+    the same slope as the fit of 'fit_name_trends'. Like there, only years in which the name was recorded are fitted and names with less than 2 of them are left out.
 
-    df_trends = pd.DataFrame(name_trends)
-    df_trends = df_trends.merge(recent_counts, on="Name", how="left")
-    df_trends_sorted = df_trends.sort_values(by="Trend_Slope", ascending=False) # sorting by the steepness 
-    top_trending_names = df_trends_sorted.head(plot_top_n).reset_index(drop=True)
+    The memory is 28 bytes per name and year, e.g. ~ 350 MB for the whole NationalNames dataset.
+    """
+    def __init__(self, name_index):
+        years = np.asarray(name_index.years)
+        self.first_year = int(years.min())
+        self.number_of_years = int(years.max()) - self.first_year + 1
+        self.names = np.asarray(name_index.keys[0], dtype=object)
+        number_of_names = len(self.names)
+
+        rows = np.repeat(np.arange(number_of_names), np.diff(name_index.offsets)) # the name of every entry of the index
+        x = (years - self.first_year).astype(np.int64)
+        y = np.asarray(name_index.counts, dtype=np.int64)
+        sums = {"n": (np.ones_like(x), np.int32), "x": (x, np.int32), "xx": (x * x, np.int32), "y": (y, np.int64), "xy": (x * y, np.int64)}
+        self._cumulative = {}
+        for name, (values, dtype) in sums.items():
+            dense = np.zeros((number_of_names, self.number_of_years), dtype=dtype)
+            dense[rows, x] = values
+            cumulative = np.zeros((number_of_names, self.number_of_years + 1), dtype=dtype)
+            np.cumsum(dense, axis=1, out=cumulative[:, 1:])
+            self._cumulative[name] = cumulative
 
-    for i, name in enumerate(top_trending_names["Name"]):
-        name_data = df_national[(df_national["Name"] == name) & (df_national["Year"] >= min_year)] # selecting only the 'years_to_analyze' years for fitting the lin.reg
-        trend_slope = top_trending_names.loc[top_trending_names["Name"] == name, "Trend_Slope"].values[0] # retrieving the slope for a specific name
+    def _end_positions(self, window_length, end_years):
+        if not 2 <= window_length <= self.number_of_years: # a fit needs at least 2 years
+            raise ValueError(f"The window length has to be from 2 to {self.number_of_years} years.")
+        if end_years is None:
+            end_years = np.arange(self.first_year + window_length - 1, self.first_year + self.number_of_years)
+        end_years = np.asarray(end_years, dtype=np.int64)
+        if np.any(end_years - window_length + 1 < self.first_year) or np.any(end_years >= self.first_year + self.number_of_years):
+            raise ValueError(f"Every window has to lie within the years {self.first_year} - {self.first_year + self.number_of_years - 1}.")
+        return end_years, end_years - self.first_year + 1 # end positions in the cumulative sums, exclusive
 
-        X = name_data["Year"].values.reshape(-1, 1)
-        y = name_data["Count"].values
+    def _window_sums(self, rows, window_length, stops):
+        return {name: (cumulative[rows][:, stops] - cumulative[rows][:, stops - window_length]).astype(np.int64) for name, cumulative in self._cumulative.items()}
 
-        model = LinearRegression() 
-        model.fit(X, y) # fitting lin.reg.
+    def _fit(self, sums):
+        numerator = sums["n"] * sums["xy"] - sums["x"] * sums["y"]
+        denominator = sums["n"] * sums["xx"] - sums["x"] * sums["x"] # 0 for less than 2 recorded years
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where(sums["n"] >= 2, numerator / denominator, np.nan)
+            intercept = (sums["y"] - slope * sums["x"]) / sums["n"] - slope * self.first_year # back from x counted from the first year to calendar years
+        return slope, intercept
 
-        X_pred = np.arange(min(X), max(X) + 1).reshape(-1, 1)
-        y_pred = model.predict(X_pred) # predicting the lin.reg. trend
+    @profiled("model")
+    def slopes(self, window_length, end_years=None, block_size=16384):
+        """
+        Returns the slopes of all names for the windows of window_length years ending in each of end_years (all possible end years if None),
+        as a pandas DataFrame with one row per name and one column per end year (NaN where the name has less than 2 recorded years in the window).
+        The names are processed in blocks of block_size rows to bound the memory of the temporary arrays.
+        """
+        window_length = int(window_length)
+        end_years, stops = self._end_positions(window_length, end_years)
+        slopes = np.empty((len(self.names), len(end_years)))
+        for start in range(0, len(self.names), block_size):
+            rows = np.arange(start, min(start + block_size, len(self.names)))
+            slopes[rows], _ = self._fit(self._window_sums(rows, window_length, stops))
+        return pd.DataFrame(slopes, index=pd.Index(self.names, name="Name"), columns=pd.Index(end_years, name="End_Year"))
 
-        plt.figure(figsize=(8, 5))
-        plt.scatter(X, y, color="blue", label="Count", alpha=0.6)
-        plt.plot(X_pred, y_pred, color="red", linestyle="-", label="Linear regression", linewidth=1)
-        plt.xticks(np.arange(min(X), max(X) + 1, 1))  # plotting only int. years, not floats
-        plt.xlabel("Year")
-        plt.ylabel("Count")
-        plt.title(f"Trend for {name} over the last {years_to_analyze} years")
-        plt.legend()
-        save_path = os.path.join(path_to_results, f"{plotname_to_save}_for_past_{years_to_analyze}_years_slope_{trend_slope:.0f}_{name}.png")
-        plt.savefig(save_path, dpi=300, bbox_inches="tight")
-        print ('The plot has been saved in the folder Results \n')
-        plt.close() 
+    @profiled("model")
+    def top_trending(self, window_lengths, end_years=None, top_n=10, block_size=16384):
+        """
+        Returns the top_n names with the steepest positive slope for every window length and end year, as a table (pandas DataFrame) with the columns:
+        Window_Length, End_Year, Rank, Name, Trend_Slope, Intercept, Points (number of fitted years), Recent_Counts (total count in the window).
+        For window length L and end year Y, the ranking is the same as the one of 'find_trending_names_by_slope' with years_to_analyze = L on data ending in Y.
 
-    print (top_trending_names)
+        Parameters:
+        window_lengths - a number of years or a list of them
+        end_years - the end years of the windows, None for all end years possible for each window length
+        top_n - number of names kept per window
+        block_size - number of names processed at once
+        """
+        tables = []
+        for window_length in np.atleast_1d(window_lengths):
+            window_length = int(window_length)
+            window_end_years, stops = self._end_positions(window_length, end_years)
+            candidates = None # for every end year, the best rows found so far, in columns
+            for start in range(0, len(self.names), block_size):
+                rows = np.arange(start, min(start + block_size, len(self.names)))
+                slope, _ = self._fit(self._window_sums(rows, window_length, stops))
+                slope = np.where(slope > 0, slope, -np.inf) # only the positive values of slope are trending
+                keep = min(top_n, len(rows))
+                best = np.argpartition(-slope, keep - 1, axis=0)[:keep] + start # the best rows of this block, per end year
+                candidates = best if candidates is None else np.vstack([candidates, best])
+            tables.append(self._rank_candidates(candidates, window_length, window_end_years, stops, top_n))
+        return pd.concat(tables, ignore_index=True)
 
+    def _rank_candidates(self, candidates, window_length, end_years, stops, top_n):
+        result = []
+        for column, (end_year, stop) in enumerate(zip(end_years, stops)):
+            rows = np.unique(candidates[:, column])
+            sums = self._window_sums(rows, window_length, np.array([stop]))
+            slope, intercept = self._fit(sums)
+            slope, intercept = slope[:, 0], intercept[:, 0]
+            positive = np.flatnonzero(slope > 0)
+            order = positive[np.argsort(-slope[positive], kind="stable")][:top_n] # sorting by the steepness
+            result.append(pd.DataFrame({"Window_Length": window_length, 
+                                        "End_Year": end_year, 
+                                        "Rank": np.arange(1, len(order) + 1), 
+                                        "Name": self.names[rows[order]], 
+                                        "Trend_Slope": slope[order], 
+                                        "Intercept": intercept[order], 
+                                        "Points": sums["n"][order, 0], 
+                                        "Recent_Counts": sums["y"][order, 0]}))
+        return pd.concat(result, ignore_index=True)
+
+def load_rolling_trend_scanner(dataset):
+    """
+    This function returns the RollingTrendScanner of a dataset, built from its name index (see 'load_name_index') the first time it is needed.
+
+    Parameter:
+    dataset - path to the NationalNames CSV file, or a DataFrame returned by 'load_dataset'
+    """
+    name_index = load_name_index(dataset)
+    memo_key = id(name_index)
+    with _memo_lock(("rolling_trend_scanner", memo_key)):
+        if memo_key in _loaded_rolling_trend_scanners and _loaded_rolling_trend_scanners[memo_key][0]() is name_index:
+            return _loaded_rolling_trend_scanners[memo_key][1]
+        with profile_span("model", "build RollingTrendScanner", rows=len(name_index.counts)):
+            scanner = RollingTrendScanner(name_index)
+        _loaded_rolling_trend_scanners[memo_key] = (weakref.ref(name_index), scanner)
+        return scanner
+
+@profiled("analysis")
 def top_10_states_most_newborns(path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
-                                top_N_states = 10
+                                top_N_states = 10, 
+                                chunk_size = None, 
+                                processes = None
                                 ):
     """
     This function loads the StateNames datasets, counts all newborns in each state, sorts states by the number of newborns and prints the top 'top_N_states' states by the number of newborns and the count of newborns.
 
     Parameters:
-    path_to_StateNames_dataset - path to the StateNames dataset
+    path_to_StateNames_dataset - path to the StateNames dataset, the dataset already loaded by 'load_dataset', or its RollupStore (see 'open_rollup_store')
     top_N_states - the number of top states we want to print
+    chunk_size - if set, the dataset is streamed in chunks of this many rows instead of being loaded whole into memory (see 'aggregate_counts')
+    processes - if set, the dataset is partitioned by state and aggregated on this many processes (see 'aggregate_counts')
     """
-    df = pd.read_csv(path_to_StateNames_dataset)
-    total_per_state = df.groupby("State")["Count"].sum().reset_index() # number of all newborns per state
+    [state_totals] = aggregate_counts(path_to_StateNames_dataset, [["State"]], chunk_size, processes)
+    total_per_state = state_totals.reset_index() # number of all newborns per state
     top_states = total_per_state.sort_values(by="Count", ascending=False).head(top_N_states).reset_index(drop=True) # sorts states by the number of all newborns, keeps the top 'top_N_states' and resets the original indexes by the new order
     
     print(top_states)
 
-def plot_top_names_by_state(path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv"
-                            ):
+def _state_top_name(partition):
     """
-    This function craetes a choropleth map of the USA where each state is colored by the most popular baby name in that state.
+    The most popular name of one state as 'plot_top_names_by_state' finds it, computed by a worker process of '_map_states'.
+    """
+    state_summary = _state_totals(partition, ["State", "Name"])
+    return [state_summary.loc[[state_summary["Count"].idxmax()]]]
 
-    Parameters:
-    file_path - path to the StateNames dataset
+def top_names_map(top_names, title="Most Popular Baby Names by State", animation_frame=None, category_orders=None):
     """
-    df = pd.read_csv(path_to_StateNames_dataset)
-    top_names = df.groupby(["State", "Name"])["Count"].sum().reset_index() #sums all occurances of the same baby name in the same state across all years,  .groupby converts the data frame to a grouped object, .reset_index converts it back
-    top_names = top_names.loc[top_names.groupby("State")["Count"].idxmax()]  # creates a grouped object - grouping states together, .idmax finds the index of the maximum count (done for each state), finally .loc makes a subsample of rows corresponding to the most occuring baby names per state
-    
-    # Create map visualization
-    fig = px.choropleth(
+    This function builds the choropleth map of 'plot_top_names_by_state' from a table with the columns State, Name and Count, one row per state.
+    With animation_frame set to a column (e.g. 'Period'), the table has one row per state and value of that column and the map gets one frame per value, with a slider.
+    category_orders is passed to plotly, e.g. {"Name": all names} keeps the color of every name the same in all frames.
+    """
+    hover_data = {"State": True, "Name": True, "Count": True} # additional data shown when hovering over
+    if animation_frame is not None:
+        hover_data[animation_frame] = True
+    return px.choropleth(
         top_names,
         locations="State",
         locationmode="USA-states",
         color="Name", # coloring states by the most popular name
         hover_name="Name", # displays the most popular baby name of the state when hovering over it with a coursor
-        hover_data={"State": True, "Name": True, "Count": True}, # additional data shown when hovering over
-        title="Most Popular Baby Names by State",
+        hover_data=hover_data,
+        animation_frame=animation_frame,
+        category_orders=category_orders,
+        title=title,
         scope="usa", # defines the map to be only USA
         color_discrete_sequence=px.colors.qualitative.Set3
     )
+
+@profiled("analysis")
+def plot_top_names_by_state(path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
+                            chunk_size = None, 
+                            processes = None, 
+                            path_to_save = None
+                            ):
+    """
+    This function craetes a choropleth map of the USA where each state is colored by the most popular baby name in that state.
+
+    Parameters:
+    file_path - path to the StateNames dataset, the dataset already loaded by 'load_dataset', or its RollupStore (see 'open_rollup_store')
+    chunk_size - if set, the dataset is streamed in chunks of this many rows instead of being loaded whole into memory (see 'aggregate_counts')
+    processes - if set, the dataset is partitioned by state and the most popular name of every state is found on this many processes (see '_map_states')
+    path_to_save - if None, the map is shown (which needs a browser), otherwise it is saved to this file without showing it, as HTML for a path ending with '.html',
+                   as an image (e.g. '.png', needs the kaleido package) otherwise
+    """
+    if _uses_state_processes(path_to_StateNames_dataset, chunk_size, processes):
+        [top_names] = _map_states(path_to_StateNames_dataset, processes, _state_top_name)
+    else:
+        [state_name_totals] = aggregate_counts(path_to_StateNames_dataset, [["State", "Name"]], chunk_size)
+        top_names = state_name_totals.reset_index() #sums all occurances of the same baby name in the same state across all years,  .groupby converts the data frame to a grouped object, .reset_index converts it back
+        top_names = top_names.loc[top_names.groupby("State", observed=True)["Count"].idxmax()]  # creates a grouped object - grouping states together, .idmax finds the index of the maximum count (done for each state), finally .loc makes a subsample of rows corresponding to the most occuring baby names per state
     
-    fig.show()
\ No newline at end of file
+    # Create map visualization
+    if path_to_save is not None: # saved without a browser, as the maps of 'plot_top_names_by_state_per_period'
+        render_plots([(_save_top_names_map, {"top_names": top_names, "title": "Most Popular Baby Names by State", "save_path": path_to_save})])
+        return
+
+    with profile_span("render", "choropleth of the top names by state", rows=len(top_names)):
+        fig = top_names_map(top_names)
+        fig.show()
+
+def _grouped_top_k(group_starts, counts, k, block_cells=1 << 22):
+    """
+    This function finds the positions of the k largest counts in every group of rows, without sorting the groups.
+
+    Parameters:
+    group_starts - the first row of every group plus the number of rows at the end, the rows of a group are contiguous
+    counts - the count of every row, non-negative
+    k - number of rows kept per group (fewer if the group is smaller)
+    block_cells - groups are processed in blocks of at most about this many cells, to bound the memory
+
+    The groups of similar size are put into the rows of one padded matrix and np.argpartition selects the k largest of every row at once,
+    in O(size of the group) instead of O(size * log(size)) of a full sort. Only the k selected rows of each group are then sorted.
+    Among equal counts, the earlier row wins, so for k = 1 the result is the same as groupby(...).idxmax() on rows sorted within the group.
+
+    Returns two arrays, the group and the row of every selected row, ordered by group and by the count descending.
+    """
+    sizes = np.diff(group_starts)
+    by_size = np.argsort(sizes, kind="stable")
+    selected_groups, selected_rows = [], []
+    block_start = 0
+    while block_start < len(by_size):
+        block_ends = np.arange(block_start + 1, len(by_size) + 1)
+        cells = (block_ends - block_start) * sizes[by_size[block_ends - 1]] # the sizes grow along by_size, so the last group of a block is the widest
+        block_end = block_start + max(1, np.searchsorted(cells, block_cells, side="right"))
+        groups = by_size[block_start:block_end]
+        width = max(1, sizes[groups[-1]])
+        block_sizes = sizes[groups]
+
+        matrix_rows = np.repeat(np.arange(len(groups)), block_sizes)
+        columns = np.arange(block_sizes.sum()) - np.repeat(np.cumsum(block_sizes) - block_sizes, block_sizes) # position of every row within its group
+        rows = group_starts[groups][matrix_rows] + columns
+        keys = np.full((len(groups), width), -1, dtype=np.int64)
+        keys[matrix_rows, columns] = counts[rows].astype(np.int64) * width + (width - 1 - columns) # unique keys, a higher count first, then the earlier row
+
+        keep = min(k, width)
+        top_columns = np.argpartition(-keys, keep - 1, axis=1)[:, :keep]
+        top_keys = np.take_along_axis(keys, top_columns, axis=1)
+        order = np.argsort(-top_keys, axis=1) # sorting only the k selected columns
+        top_columns = np.take_along_axis(top_columns, order, axis=1)
+        valid = np.take_along_axis(top_keys, order, axis=1) >= 0 # the padding of groups smaller than k
+        selected_groups.append(np.broadcast_to(groups[:, None], top_columns.shape)[valid])
+        selected_rows.append((group_starts[groups][:, None] + top_columns)[valid])
+        block_start = block_end
+
+    selected_groups = np.concatenate(selected_groups) if selected_groups else np.array([], dtype=np.int64)
+    selected_rows = np.concatenate(selected_rows) if selected_rows else np.array([], dtype=np.int64)
+    order = np.argsort(selected_groups, kind="stable") # back to the order of the groups, the order within a group is kept
+    return selected_groups[order], selected_rows[order]
+
+@profiled("analysis")
+def top_names_by_state_per_period(path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
+                                  period = 'year', 
+                                  top_k = 10, 
+                                  chunk_size = None, 
+                                  processes = None
+                                  ):
+    """
+    This function finds the top_k most popular names of every state in every year or decade.
+
+    Parameters:
+    path_to_StateNames_dataset - path to the StateNames dataset, or the dataset already loaded by 'load_dataset'
+    period - either 'year' or 'decade' (a decade is labeled by its first year, e.g. 1910 for 1910-1919)
+    top_k - number of names kept per state and period
+    chunk_size, processes - how the (State, Year, Name) aggregate is computed (see 'aggregate_counts')
+
+    All periods come from one (State, Year, Name) aggregate of the dataset, the decades are summed from it in memory.
+    The top names of all (state, period) groups are then selected at once by a grouped partial sort (see '_grouped_top_k').
+    Returns a pandas DataFrame with the columns Period, State, Rank, Name and Count, sorted by Period, State and Rank.
+    Names with the same count are ranked alphabetically, so the name of rank 1 is the one 'plot_top_names_by_state' would show for that period.
+    """
+    if period not in ('year', 'decade'):
+        raise ValueError("Invalid value. The 'period' expects input to be 'year' or 'decade'.")
+
+    [state_year_name_totals] = aggregate_counts(path_to_StateNames_dataset, [["State", "Year", "Name"]], chunk_size, processes)
+    totals = state_year_name_totals.reset_index().rename(columns={"Year": "Period"}) # sorted by the state, the year and the name, so every (state, year) group is contiguous
+    if period == 'decade':
+        totals["Period"] = totals["Period"] // 10 * 10
+        totals = totals.groupby(["State", "Period", "Name"], observed=True)["Count"].sum().reset_index()
+
+    period_values = totals["Period"].to_numpy()
+    state_codes = totals["State"].cat.codes.to_numpy() if isinstance(totals["State"].dtype, pd.CategoricalDtype) else pd.factorize(totals["State"])[0]
+    group_changes = np.r_[True, (period_values[1:] != period_values[:-1]) | (state_codes[1:] != state_codes[:-1])]
+    group_starts = np.append(np.flatnonzero(group_changes), len(totals))
+    groups, rows = _grouped_top_k(group_starts, totals["Count"].to_numpy(), top_k)
+
+    top_names = totals.iloc[rows][["Period", "State", "Name", "Count"]].reset_index(drop=True)
+    top_names.insert(2, "Rank", np.arange(len(groups)) - np.searchsorted(groups, groups) + 1) # position within the group
+    return top_names.sort_values(by=["Period", "State", "Rank"], kind="stable").reset_index(drop=True)
+
+def _save_top_names_map(top_names, title, save_path):
+    fig = top_names_map(top_names, title)
+    if save_path.endswith(".html"):
+        fig.write_html(save_path, include_plotlyjs="directory") # plotly.min.js is written once next to the maps, so they work offline
+    else:
+        fig.write_image(save_path) # needs the kaleido package
+
+def _save_top_names_animation(top_names, title, save_path):
+    top_names = top_names.assign(Period=top_names["Period"].astype(str))
+    fig = top_names_map(top_names, title, animation_frame="Period", category_orders={"Name": sorted(top_names["Name"].unique())}) # every name keeps its color in all frames
+    fig.write_html(save_path, include_plotlyjs="directory")
+
+@profiled("analysis")
+def plot_top_names_by_state_per_period(path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", 
+                                       period = 'decade', 
+                                       path_to_results = r"C:\Users\matej\VSCode_projects\STRV_test_project\STRV_test_project\Results", 
+                                       plotname_to_save = 'top_names_by_state', 
+                                       file_format = 'html', 
+                                       animated = False, 
+                                       render_processes = None, 
+                                       chunk_size = None, 
+                                       processes = None
+                                       ):
+    """
+    This function saves the map of 'plot_top_names_by_state' for every year or decade of the StateNames dataset, without showing them (no browser is needed).
+
+    Parameters:
+    path_to_StateNames_dataset - path to the StateNames dataset, or the dataset already loaded by 'load_dataset'
+    period - either 'year' or 'decade'
+    path_to_results - path for the directory to which the maps are saved
+    plotname_to_save - starting part of the file names, the period is added after it, e.g. 'top_names_by_state_1910.html'
+    file_format - 'html' (interactive maps, plotly.min.js is saved once next to them) or an image format such as 'png' (needs the kaleido package)
+    animated - if True, a single HTML file '<plotname_to_save>_per_<period>.html' is saved instead, with one animation frame per period
+    render_processes - number of processes saving the maps, None to save them in this process (see 'render_plots')
+    chunk_size, processes - how the aggregate of the dataset is computed (see 'aggregate_counts')
+
+    All maps cost one aggregation of the dataset (see 'top_names_by_state_per_period'), not one read of the dataset per map.
+    Returns the table of the most popular name of every state and period, with the columns Period, State, Rank, Name and Count.
+    """
+    top_names = top_names_by_state_per_period(path_to_StateNames_dataset, period, 1, chunk_size, processes)
+    os.makedirs(path_to_results, exist_ok=True)
+
+    if animated:
+        jobs = [(_save_top_names_animation, {"top_names": top_names, 
+                                             "title": f"Most Popular Baby Names by State per {period}", 
+                                             "save_path": os.path.join(path_to_results, f"{plotname_to_save}_per_{period}.html")})]
+    else:
+        jobs = [(_save_top_names_map, {"top_names": period_top_names, 
+                                       "title": f"Most Popular Baby Names by State in {'the ' + str(period_value) + 's' if period == 'decade' else period_value}", 
+                                       "save_path": os.path.join(path_to_results, f"{plotname_to_save}_{period_value}.{file_format}")})
+                for period_value, period_top_names in top_names.groupby("Period")]
+    render_plots(jobs, render_processes)
+    return top_names
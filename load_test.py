@@ -0,0 +1,141 @@
+"""
+Load test of the HTTP service of 'service.py' running on localhost.
+
+A number of clients, each with its own keep-alive connection, send a mix of requests as fast as the service answers them.
+The names asked about are the most popular names of the StateNames dataset, read from the service itself at the start.
+For every endpoint it prints the number of requests, errors and the latency percentiles in milliseconds, and optionally saves them to a JSON file.
+
+Usage:
+python service.py --national ... --state ...                            - in one terminal
+python load_test.py --connections 16 --requests 20000 --report load.json - in another one
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote
+
+class _Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, target):
+        """
+        Sends one GET request and returns the status and the body of the answer, reconnecting if the service closed the connection.
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode("latin-1"))
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader, self.writer = None, None
+
+def _request_mix(names, states, png):
+    """
+    Returns a function drawing the next request as (endpoint, target), the endpoint is the label used in the results.
+    """
+    def history(rng):
+        return "history", f"/names/{quote(rng.choice(names))}/history"
+    def history_state(rng):
+        return "history state", f"/names/{quote(rng.choice(names))}/history?dataset=State&state={rng.choice(states)}"
+    def average(rng):
+        start = rng.randint(1880, 2000)
+        return "average", f"/names/{quote(rng.choice(names))}/average?start={start}&end={start + rng.randint(0, 30)}"
+    def unisex(rng):
+        return "unisex", f"/unisex/random?min_score=0.8&min_count=10000"
+    def top_names(rng):
+        return "top names", f"/states/top-names?state={rng.choice(states)}&k=10"
+    def history_png(rng):
+        return "history png", f"/names/{quote(rng.choice(names[:20]))}/history?format=png" # a small set, so most answers come from the cache of rendered plots
+
+    requests = [history, history_state, average, unisex, top_names] + ([history_png] if png else [])
+    return lambda rng: rng.choice(requests)(rng)
+
+def _percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+async def run_load_test(host="127.0.0.1", port=8000, connections=16, requests=10000, png=False, seed=0):
+    """
+    This function runs the load test and returns its results:
+    {"connections", "requests", "seconds", "requests_per_second", "endpoints": {endpoint: {"requests", "errors", "p50_ms", "p90_ms", "p99_ms", "max_ms"}}}
+    Answers with a status other than 200 and 404 (an unknown name in a state) are counted as errors.
+    """
+    setup = _Connection(host, port)
+    status, body = await setup.get("/states/top-names?k=50")
+    if status != 200:
+        raise RuntimeError(f"The service answered {status}: {body.decode()}")
+    top_names = json.loads(body)["states"]
+    states = sorted(top_names)
+    names = list(dict.fromkeys(entry["name"] for state in states for entry in top_names[state])) # without duplicates, in a fixed order
+    setup.close()
+
+    next_request = _request_mix(names, states, png)
+    latencies = {}
+    errors = {}
+    remaining = [requests]
+
+    async def client(number):
+        rng = random.Random(seed * 1000003 + number)
+        connection = _Connection(host, port)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                endpoint, target = next_request(rng)
+                start = time.perf_counter()
+                status, _ = await connection.get(target)
+                latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+                if status not in (200, 404):
+                    errors[endpoint] = errors.get(endpoint, 0) + 1
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(connections)))
+    seconds = time.perf_counter() - start
+
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        values = sorted(values)
+        endpoints[endpoint] = {"requests": len(values), "errors": errors.get(endpoint, 0),
+                               "p50_ms": _percentile(values, 50) * 1000, "p90_ms": _percentile(values, 90) * 1000,
+                               "p99_ms": _percentile(values, 99) * 1000, "max_ms": values[-1] * 1000}
+    return {"connections": connections, "requests": requests, "seconds": seconds, "requests_per_second": requests / seconds, "endpoints": endpoints}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the HTTP service of service.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--connections", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=10000, help="total number of requests")
+    parser.add_argument("--png", action="store_true", help="include requests for the PNG plots")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--report", default=None, help="path of a JSON file for the results")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load_test(args.host, args.port, args.connections, args.requests, args.png, args.seed))
+    print(f"{results['requests']} requests on {results['connections']} connections in {results['seconds']:.2f} s, {results['requests_per_second']:.0f} requests/s")
+    print(f"{'endpoint':<15} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, measured in results["endpoints"].items():
+        print(f"{endpoint:<15} {measured['requests']:>9} {measured['errors']:>7} {measured['p50_ms']:>8.2f} {measured['p90_ms']:>8.2f} {measured['p99_ms']:>8.2f} {measured['max_ms']:>8.2f}")
+    if args.report is not None:
+        with open(args.report, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
@@ -7,84 +7,120 @@ print("Path to dataset files:", path)
 functions_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'STRV_TEST_PROJECT'))
 sys.path.append(functions_path)
 import functions
+from pipeline import Pipeline
 
 path_to_results = r"C:\Users\matej\VSCode_projects\STRV_test_project\STRV_test_project\Results"
 path_to_NationalNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv"
 path_to_StateNames_dataset = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv"
-print ()
-print (' -----------------------------------------------------')
-print ('Exploring the fundamentals of the datasets')
-functions.check_year_span(file_path = path_to_NationalNames_dataset, 
-                          dataset_name = 'NationalNames'
-                          )
-functions.check_year_span(file_path = path_to_StateNames_dataset, 
-                          dataset_name = 'StateNames'
-                          )
-print ()
-print (' -----------------------------------------------------')
-print ('Explore the dataset, task 1. How did the name Ida change period-over-period nationally?')
-functions.plot_name_occurance_change_over_time(path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
-                                               path_to_StateNames_dataset = path_to_StateNames_dataset, 
-                                               name = 'Ida', 
-                                               dataset = 'National', 
-                                               state = None, 
-                                               path_to_results = path_to_results, 
-                                               plotname_to_save = 'Ida_change_over_time_national'
-                                               ) 
+path_to_rollups = r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\rollups"
 
-functions.average_occurrence_in_time_period_national(path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
-                                                     name = "Ida", 
-                                                     start_year = 1910, 
-                                                     end_year = 1930
-                                                     ) # just to get some statistics for the documentation
-print ()
-print (' -----------------------------------------------------')
-print ('Explore the dataset, task 2. How did the name Ida change period-over-period in California?')
-functions.plot_name_occurance_change_over_time(path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
-                                               path_to_StateNames_dataset = path_to_StateNames_dataset, 
-                                               name = 'Ida', 
-                                               dataset = 'State', 
-                                               state = 'CA', 
-                                               path_to_results = path_to_results, 
-                                               plotname_to_save = 'Ida_change_over_time_state_CA'
-                                               )
-print ()
-print (' -----------------------------------------------------')
-print ('Explore the dataset, task 3. What name is the most unisex?')
-functions.random_most_unisex_name(path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
-                                  path_to_StateNames_dataset = path_to_StateNames_dataset,
-                                  dataset = 'National', 
-                                  minimum_unisex_score = 0.8,  
-                                  minimum_name_count = 10000, 
-                                  printing_the_names = True
-                                  )
-print ()
-print (' -----------------------------------------------------')
-print ('Explore the dataset, task 4. Which names are common nationally but rare at the state level?')
-functions.find_common_national_rare_state(path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
-                                          path_to_StateNames_dataset = path_to_StateNames_dataset,
-                                          threshold_national=0.75, 
-                                          threshold_state=0.65, 
-                                          sort_by='State', 
-                                          keep_only_the_lowest_state_per_name=True
-                                          )
-print ()
-print (' -----------------------------------------------------')
-print ('Presentation task 1. Find the TOP 10 trending names')
+# the aggregates used by the analyses are kept up to date on disk, a new download only adds the years that are new or changed
+national_rollups = functions.open_rollup_store(os.path.join(path_to_rollups, 'National'), dataset = 'National')
+state_rollups = functions.open_rollup_store(os.path.join(path_to_rollups, 'State'), dataset = 'State')
+national_rollups.ingest(path_to_NationalNames_dataset)
+state_rollups.ingest(path_to_StateNames_dataset)
 
-functions.find_trending_names_by_slope(path_to_NationalNames_dataset = path_to_NationalNames_dataset,
-                                       years_to_analyze=3, 
-                                       plot_top_n = 10,
-                                       path_to_results = path_to_results,
-                                       plotname_to_save = 'trending_analysis'
-                                       )
-print ()
-print (' -----------------------------------------------------')
-print ('Presentation task 2. Find the TOP 10 states with the most newborns')
-functions.top_10_states_most_newborns(path_to_StateNames_dataset = path_to_StateNames_dataset, 
-                                      top_N_states = 10
-                                      )
-print ()
-print (' -----------------------------------------------------')
-print ('Presentation task 3. Make a map of the USA showing the top names by state')
-functions.plot_top_names_by_state(path_to_StateNames_dataset)
\ No newline at end of file
+pipeline = Pipeline(persist_aggregates=True)
+
+pipeline.add('Exploring the fundamentals of the datasets', 
+             functions.check_year_span, 
+             needs = [pipeline.dataset(path_to_NationalNames_dataset)], 
+             file_path = path_to_NationalNames_dataset, 
+             dataset_name = 'NationalNames'
+             )
+pipeline.add(None, 
+             functions.check_year_span, 
+             needs = [pipeline.dataset(path_to_StateNames_dataset)], 
+             file_path = path_to_StateNames_dataset, 
+             dataset_name = 'StateNames'
+             )
+
+pipeline.add('Explore the dataset, task 1. How did the name Ida change period-over-period nationally?', 
+             functions.plot_name_occurance_change_over_time, 
+             needs = [pipeline.name_index(path_to_NationalNames_dataset)], 
+             uses_pyplot = True, 
+             path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
+             path_to_StateNames_dataset = path_to_StateNames_dataset, 
+             name = 'Ida', 
+             dataset = 'National', 
+             state = None, 
+             path_to_results = path_to_results, 
+             plotname_to_save = 'Ida_change_over_time_national'
+             )
+pipeline.add(None, 
+             functions.average_occurrence_in_time_period_national, 
+             needs = [pipeline.name_index(path_to_NationalNames_dataset)], 
+             path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
+             name = "Ida", 
+             start_year = 1910, 
+             end_year = 1930
+             ) # just to get some statistics for the documentation
+
+pipeline.add('Explore the dataset, task 2. How did the name Ida change period-over-period in California?', 
+             functions.plot_name_occurance_change_over_time, 
+             needs = [pipeline.name_index(path_to_StateNames_dataset, by_state=True)], 
+             uses_pyplot = True, 
+             path_to_NationalNames_dataset = path_to_NationalNames_dataset, 
+             path_to_StateNames_dataset = path_to_StateNames_dataset, 
+             name = 'Ida', 
+             dataset = 'State', 
+             state = 'CA', 
+             path_to_results = path_to_results, 
+             plotname_to_save = 'Ida_change_over_time_state_CA'
+             )
+
+pipeline.add('Explore the dataset, task 3. What name is the most unisex?', 
+             functions.random_most_unisex_name, 
+             needs = [pipeline.aggregate(national_rollups, "Name", "Gender")], 
+             path_to_NationalNames_dataset = national_rollups, 
+             path_to_StateNames_dataset = state_rollups,
+             dataset = 'National', 
+             minimum_unisex_score = 0.8,  
+             minimum_name_count = 10000, 
+             printing_the_names = True
+             )
+
+pipeline.add('Explore the dataset, task 4. Which names are common nationally but rare at the state level?', 
+             functions.find_common_national_rare_state, 
+             needs = [pipeline.aggregate(national_rollups, "Name"), pipeline.aggregate(state_rollups, "State", "Name")], 
+             path_to_NationalNames_dataset = national_rollups, 
+             path_to_StateNames_dataset = state_rollups,
+             threshold_national=0.75, 
+             threshold_state=0.65, 
+             sort_by='State', 
+             keep_only_the_lowest_state_per_name=True
+             )
+
+pipeline.add('Presentation task 1. Find the TOP 10 trending names', 
+             functions.find_trending_names_by_slope, 
+             needs = [pipeline.aggregate(path_to_NationalNames_dataset, "Name", "Year")], 
+             uses_pyplot = True, 
+             path_to_NationalNames_dataset = path_to_NationalNames_dataset,
+             years_to_analyze=3, 
+             plot_top_n = 10,
+             path_to_results = path_to_results,
+             plotname_to_save = 'trending_analysis'
+             )
+
+pipeline.add('Presentation task 2. Find the TOP 10 states with the most newborns', 
+             functions.top_10_states_most_newborns, 
+             needs = [pipeline.aggregate(state_rollups, "State")], 
+             path_to_StateNames_dataset = state_rollups, 
+             top_N_states = 10
+             )
+
+pipeline.add('Presentation task 3. Make a map of the USA showing the top names by state', 
+             functions.plot_top_names_by_state, 
+             needs = [pipeline.aggregate(state_rollups, "State", "Name")], 
+             path_to_StateNames_dataset = state_rollups
+             )
+pipeline.add(None, 
+             functions.plot_top_names_by_state_per_period, 
+             needs = [pipeline.aggregate(path_to_StateNames_dataset, "State", "Year", "Name")], 
+             path_to_StateNames_dataset = path_to_StateNames_dataset, 
+             period = 'decade', 
+             path_to_results = path_to_results, 
+             plotname_to_save = 'top_names_by_state'
+             ) # the same map for every decade, saved as HTML files
+
+pipeline.run()
@@ -0,0 +1,120 @@
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import matplotlib.pyplot as plt
+import functions
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Replacement of sys.stdout while a pipeline runs. Everything printed by an analysis goes into the buffer of the thread running it,
+    so the outputs of analyses running at the same time do not mix and can be printed in the order in which the analyses were added.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.buffers = {}
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.get_ident(), self.default)
+        return buffer.write(text)
+
+    def flush(self):
+        self.default.flush()
+
+class Pipeline:
+    """
+    This class runs the analyses of 'main.py' as a small task graph.
+
+    Each analysis declares the intermediate results it needs (see the methods 'dataset', 'aggregate' and 'name_index').
+    When the pipeline runs, every needed intermediate is computed only once, even if several analyses need it, and only if some analysis needs it.
+    The analyses then run concurrently on a thread pool, each one as soon as its own needs are ready, and their printed outputs are shown in the order in which they were added.
+    The intermediates are memoized by 'functions.py' itself, so the analyses get them simply by calling the functions as usual.
+
+    Parameters:
+    max_workers - number of threads, None for the default of ThreadPoolExecutor
+    persist_aggregates - if True, the aggregates are also stored on disk next to the dataset cache and reused by later runs (see 'functions.aggregate_counts')
+    """
+    def __init__(self, max_workers=None, persist_aggregates=False):
+        self.max_workers = max_workers
+        self.persist_aggregates = persist_aggregates
+        self.analyses = []
+        self._pyplot_lock = threading.Lock() # pyplot keeps one global current figure, so the analyses that plot with it take turns
+
+    @staticmethod
+    def dataset(dataset):
+        """Need of the whole dataset, as loaded by 'functions.load_dataset'."""
+        return ("dataset", dataset, None)
+
+    @staticmethod
+    def aggregate(dataset, *grouping):
+        """Need of the Count sums of a dataset grouped by the given columns, as computed by 'functions.aggregate_counts'."""
+        return ("aggregate", dataset, grouping)
+
+    @staticmethod
+    def name_index(dataset, by_state=False):
+        """Need of the name index of a dataset, as built by 'functions.load_name_index'."""
+        return ("name_index", dataset, by_state)
+
+    def add(self, title, function, needs=(), uses_pyplot=False, **kwargs):
+        """
+        This method adds an analysis, the call function(**kwargs), to the pipeline.
+
+        Parameters:
+        title - printed before the output of the analysis, None to print nothing (for analyses continuing the previous one)
+        function - the function of the analysis, usually one from 'functions.py'
+        needs - list of the intermediate results the function uses, created by the methods 'dataset', 'aggregate' and 'name_index'
+        uses_pyplot - True for functions plotting with matplotlib.pyplot, these never run at the same time as each other
+        """
+        self.analyses.append({"title": title, "function": function, "needs": list(needs), "uses_pyplot": uses_pyplot, "kwargs": kwargs})
+
+    def _prepare(self, need):
+        kind, dataset, argument = need
+        if kind == "dataset":
+            functions.load_dataset(dataset)
+        elif kind == "aggregate":
+            functions.aggregate_counts(dataset, [list(argument)])
+        elif kind == "name_index":
+            functions.load_name_index(dataset, by_state=argument)
+        else:
+            raise ValueError(f"Unknown need {need}")
+
+    def _run_analysis(self, analysis, need_futures, output):
+        for future in need_futures:
+            future.result() # waits for the needs, re-raises their errors
+        buffer = io.StringIO()
+        output.buffers[threading.get_ident()] = buffer
+        try:
+            if analysis["uses_pyplot"]:
+                with self._pyplot_lock:
+                    analysis["function"](**analysis["kwargs"])
+            else:
+                analysis["function"](**analysis["kwargs"])
+        finally:
+            del output.buffers[threading.get_ident()]
+        return buffer.getvalue()
+
+    def run(self):
+        """
+        This method runs all added analyses and prints their outputs in the order in which they were added.
+        """
+        needs = list(dict.fromkeys(need for analysis in self.analyses for need in analysis["needs"])) # every intermediate once, in the order of first use
+        if any(analysis["uses_pyplot"] for analysis in self.analyses):
+            plt.switch_backend("Agg") # the plots are only saved, and GUI backends cannot draw from worker threads
+
+        persist_aggregates = functions.PERSIST_AGGREGATES
+        functions.PERSIST_AGGREGATES = self.persist_aggregates or persist_aggregates
+        output = _ThreadOutput(sys.stdout)
+        sys.stdout = output
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                need_futures = {need: executor.submit(self._prepare, need) for need in needs} # submitted before the analyses, so an analysis never waits for a need that has not started yet
+                analysis_futures = [executor.submit(self._run_analysis, analysis, [need_futures[need] for need in analysis["needs"]], output) for analysis in self.analyses]
+                for analysis, future in zip(self.analyses, analysis_futures):
+                    if analysis["title"] is not None:
+                        print ()
+                        print (' -----------------------------------------------------')
+                        print (analysis["title"])
+                    print (future.result(), end='')
+        finally:
+            sys.stdout = output.default
+            functions.PERSIST_AGGREGATES = persist_aggregates
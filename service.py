@@ -0,0 +1,324 @@
+"""
+Local HTTP service answering the questions of 'functions.py' live, without re-reading the datasets for every answer.
+
+The datasets are loaded once at the start into the indexed structures of 'functions.py' (name indexes, range query engine, unisex name sampler,
+per-state name totals), then every request is a lookup in memory. It uses only asyncio from the standard library, one process and one event loop,
+the plots are rendered on a separate thread or on worker processes so they never block the other requests.
+
+Usage:
+python service.py --national path/to/NationalNames.csv --state path/to/StateNames.csv [--host 127.0.0.1] [--port 8000] [--render-processes 2]
+
+Endpoints (all GET, the answers are JSON unless a format says otherwise):
+/health                                                  - {"status": "ok"}
+/names/<name>/history?dataset=National&state=CA&format=json|png
+                                                         - the yearly counts of a name, as 'plot_name_occurance_change_over_time' plots them
+/names/<name>/average?start=1910&end=1930                - the statistics of 'average_occurrence_in_time_period_national' for the period
+/unisex/random?min_score=0.9&min_count=3000&k=1&weighted=0
+                                                         - random names from the selection of 'random_most_unisex_name'
+/states/top-names?state=CA&k=10&format=json|html         - the k most popular names of every state (or of one state),
+                                                           format=html gives the map of 'plot_top_names_by_state'
+A parameter out of its range is answered with 400: k from 1 to MAX_K, min_score a number from 0 to 1, min_count a non-negative integer, start and end years from 0 to 9999.
+A malformed request head is answered with 400 (431 for a header line longer than the stream limit or too many headers) and the connection is closed.
+"""
+import argparse
+import asyncio
+import collections
+import io
+import json
+import math
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import functions
+
+MAX_K = 1000 # the largest number of names a single request can ask for
+_MAX_COUNT = np.iinfo(np.int64).max
+_MAX_HEADERS = 100 # the largest number of header lines of a request
+
+_STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+class _HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _render_png(name_count_per_year, title):
+    """
+    This function renders the plot of 'plot_name_occurance_change_over_time' into PNG bytes instead of a file.
+    It is a module-level function, so it can also run on a worker process.
+    """
+    buffer = io.BytesIO()
+    functions.plot_name_count_per_year(name_count_per_year, title, buffer)
+    return buffer.getvalue()
+
+class NamesService:
+    """
+    This class holds the in-memory structures of both datasets and answers the requests of the HTTP service.
+
+    Parameters:
+    path_to_NationalNames_dataset, path_to_StateNames_dataset - paths to the CSV files, loaded through their caches on disk (see 'functions.load_dataset')
+    render_processes - None renders the PNG plots on one background thread, a number renders them on that many processes
+    png_cache_size - number of rendered PNG plots kept in memory, a repeated request for the same plot is then answered without rendering
+    seed - seed of the random generator of the unisex names, None for a different sequence in every run
+    """
+    def __init__(self, path_to_NationalNames_dataset, path_to_StateNames_dataset, render_processes=None, png_cache_size=256, seed=None):
+        self.path_to_NationalNames_dataset = path_to_NationalNames_dataset
+        self.path_to_StateNames_dataset = path_to_StateNames_dataset
+
+        # everything is built here, so the first request of each kind is as fast as the others
+        functions.load_name_index(path_to_NationalNames_dataset)
+        functions.load_name_index(path_to_StateNames_dataset)
+        functions.load_name_index(path_to_StateNames_dataset, by_state=True)
+        self.range_query_engine = functions.load_range_query_engine(path_to_NationalNames_dataset)
+        self.unisex_name_sampler = functions.load_unisex_name_sampler(path_to_NationalNames_dataset)
+        self.rng = np.random.default_rng(seed)
+
+        [state_name_totals] = functions.aggregate_counts(path_to_StateNames_dataset, [["State", "Name"]])
+        ranked = state_name_totals.reset_index().sort_values(by=["State", "Count"], ascending=[True, False], kind="stable") # within a state, names of the same count keep the alphabetical order, so the first one is the one 'plot_top_names_by_state' shows
+        states = ranked["State"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, states[1:] != states[:-1]])
+        stops = np.append(starts[1:], len(states))
+        names = ranked["Name"].to_numpy(dtype=object)
+        counts = ranked["Count"].to_numpy()
+        self.names_by_state = {str(states[start]): (names[start:stop], counts[start:stop]) for start, stop in zip(starts, stops)} # every state's names, the most popular first
+        self._top_names_map_html = None
+
+        if render_processes is None:
+            plt.switch_backend("Agg") # the plots are only rendered into bytes, and GUI backends cannot draw from a worker thread
+            self._render_executor = ThreadPoolExecutor(max_workers=1) # pyplot keeps one global figure, so one thread renders at a time
+        else:
+            self._render_executor = ProcessPoolExecutor(max_workers=render_processes, initializer=functions.init_render_process, initargs=(functions.PROFILE_PATH,))
+        self._png_cache = collections.OrderedDict()
+        self._png_cache_size = png_cache_size
+        self._png_cache_lock = threading.Lock()
+
+    def close(self):
+        self._render_executor.shutdown()
+
+    def history(self, name, dataset='National', state=None):
+        """
+        Returns the yearly counts of the name as {"name", "dataset", "state", "years", "counts"}, the data of 'plot_name_occurance_change_over_time'.
+        """
+        name_count_per_year, _ = self._name_count_per_year(name, dataset, state)
+        return {"name": name, "dataset": dataset, "state": state,
+                "years": name_count_per_year.index.tolist(), "counts": name_count_per_year.tolist()}
+
+    async def history_png(self, name, dataset='National', state=None):
+        """
+        Returns the plot of 'plot_name_occurance_change_over_time' as PNG bytes.
+        """
+        key = (name, dataset, state)
+        with self._png_cache_lock:
+            if key in self._png_cache:
+                self._png_cache.move_to_end(key)
+                return self._png_cache[key]
+        name_count_per_year, title = self._name_count_per_year(name, dataset, state)
+        png = await asyncio.get_running_loop().run_in_executor(self._render_executor, _render_png, name_count_per_year, title)
+        with self._png_cache_lock:
+            self._png_cache[key] = png
+            while len(self._png_cache) > self._png_cache_size:
+                self._png_cache.popitem(last=False)
+        return png
+
+    def _name_count_per_year(self, name, dataset, state):
+        if dataset not in ('National', 'State'):
+            raise _HTTPError(400, "The 'dataset' expects input to be 'National' or 'State'.")
+        name_count_per_year, title = functions.lookup_name_count_per_year(self.path_to_NationalNames_dataset, self.path_to_StateNames_dataset, name, dataset, state)
+        if len(name_count_per_year) == 0:
+            raise _HTTPError(404, f"The name {name} is not in the {dataset} dataset" + (f" for the state {state}." if dataset == 'State' and state is not None else "."))
+        return name_count_per_year, title
+
+    def average(self, name, start_year, end_year):
+        """
+        Returns the statistics of 'average_occurrence_in_time_period_national' as {"name", "start_year", "end_year", "average_occurrence", "max_yearly_occurrence", "max_year"}.
+        """
+        statistics = self.range_query_engine.query([name], start_year, end_year).iloc[0]
+        return {"name": name, "start_year": start_year, "end_year": end_year,
+                "average_occurrence": float(statistics["Average_Occurrence"]),
+                "max_yearly_occurrence": int(statistics["Max_Yearly_Occurrence"]),
+                "max_year": None if pd.isna(statistics["Max_Year"]) else int(statistics["Max_Year"])} # None if the name has no record in the period
+
+    def random_unisex(self, minimum_unisex_score=0.9, minimum_name_count=3000, k=1, weighted=False):
+        """
+        Returns {"names": [...]}, k names drawn as 'random_most_unisex_name' draws one (see 'functions.UnisexNameSampler.sample').
+        """
+        if len(self.unisex_name_sampler.unisex_names(minimum_unisex_score, minimum_name_count)) == 0:
+            raise _HTTPError(404, "No name passes the 'min_score' and 'min_count' thresholds.")
+        names = self.unisex_name_sampler.sample(k, minimum_unisex_score, minimum_name_count, weighted, self.rng)
+        return {"names": names.tolist()}
+
+    def top_names(self, state=None, k=1):
+        """
+        Returns {"states": {state: [{"name", "count"}, ...]}} with the k most popular names of the state, or of every state if state is None.
+        """
+        if state is not None and state not in self.names_by_state:
+            raise _HTTPError(404, f"The state {state} is not in the StateNames dataset.")
+        states = [state] if state is not None else list(self.names_by_state)
+        return {"states": {state: [{"name": name, "count": int(count)} for name, count in zip(*(values[:k] for values in self.names_by_state[state]))]
+                           for state in states}}
+
+    def top_names_map_html(self):
+        """
+        Returns the map of 'plot_top_names_by_state' as a standalone HTML page (the plotly library is loaded from its CDN).
+        """
+        if self._top_names_map_html is None:
+            top_names = [{"State": state, "Name": names[0], "Count": int(counts[0])} for state, (names, counts) in self.names_by_state.items()]
+            self._top_names_map_html = functions.top_names_map(pd.DataFrame(top_names)).to_html(include_plotlyjs="cdn")
+        return self._top_names_map_html
+
+    async def respond(self, method, target):
+        """
+        Answers one request, returns the HTTP status, the content type and the body.
+        """
+        if method != "GET":
+            raise _HTTPError(405, "Only GET requests are supported.")
+        url = urlsplit(target)
+        parameters = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = [unquote(part) for part in url.path.strip("/").split("/")]
+
+        if path == ["health"]:
+            return 200, "application/json", {"status": "ok"}
+        if len(path) == 3 and path[0] == "names" and path[2] == "history":
+            dataset = parameters.get("dataset", "National")
+            state = parameters.get("state")
+            if parameters.get("format", "json") == "png":
+                return 200, "image/png", await self.history_png(path[1], dataset, state)
+            return 200, "application/json", self.history(path[1], dataset, state)
+        if len(path) == 3 and path[0] == "names" and path[2] == "average":
+            if "start" not in parameters or "end" not in parameters:
+                raise _HTTPError(400, "The parameters 'start' and 'end' are required.")
+            return 200, "application/json", self.average(path[1], _integer(parameters, "start", minimum=0, maximum=9999), _integer(parameters, "end", minimum=0, maximum=9999))
+        if path == ["unisex", "random"]:
+            return 200, "application/json", self.random_unisex(_number(parameters, "min_score", 0.9, minimum=0, maximum=1),
+                                                               _integer(parameters, "min_count", 3000, minimum=0, maximum=_MAX_COUNT),
+                                                               _integer(parameters, "k", 1, minimum=1, maximum=MAX_K), parameters.get("weighted", "0") in ("1", "true"))
+        if path == ["states", "top-names"]:
+            if parameters.get("format", "json") == "html":
+                return 200, "text/html; charset=utf-8", self.top_names_map_html()
+            return 200, "application/json", self.top_names(parameters.get("state"), _integer(parameters, "k", 1, minimum=1, maximum=MAX_K))
+        raise _HTTPError(404, f"Unknown endpoint {url.path}")
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves the requests of one connection, kept open between requests (HTTP/1.1 keep-alive) until the client closes it.
+        """
+        try:
+            while True:
+                headers = {}
+                version = "HTTP/1.0" # until the whole request head is read, an error is answered and the connection closed
+                try:
+                    request_line = await _read_line(reader, 400, "The request line is too long.")
+                    if not request_line:
+                        break
+                    headers = await _read_headers(reader)
+                    request = request_line.decode("latin-1").split()
+                    if len(request) != 3:
+                        raise _HTTPError(400, "Malformed request line.")
+                    content_length = _content_length(headers)
+                    if content_length > 0:
+                        await reader.readexactly(content_length) # a body is not used by any endpoint
+                    version = request[2]
+                    status, content_type, body = await self.respond(request[0], request[1])
+                except (ConnectionError, asyncio.IncompleteReadError): # the client went away, handled below
+                    raise
+                except _HTTPError as error:
+                    status, content_type, body = error.status, "application/json", {"error": str(error)}
+                except Exception as error: # the service keeps running whatever a single request does
+                    status, content_type, body = 500, "application/json", {"error": f"{type(error).__name__}: {error}"}
+
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode()
+                elif isinstance(body, str):
+                    body = body.encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status} {_STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError): # the client went away
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        """
+        Runs the HTTP service on host:port until it is cancelled.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+async def _read_line(reader, status, message):
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError): # the line is longer than the limit of the StreamReader
+        raise _HTTPError(status, message)
+
+async def _read_headers(reader):
+    headers = {}
+    while True:
+        line = await _read_line(reader, 431, "A request header is too long.")
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        if len(headers) >= _MAX_HEADERS:
+            raise _HTTPError(431, f"A request can have at most {_MAX_HEADERS} headers.")
+        key, separator, value = line.decode("latin-1").partition(":")
+        if not separator:
+            raise _HTTPError(400, "Malformed header line.")
+        headers[key.strip().lower()] = value.strip()
+
+def _content_length(headers):
+    value = headers.get("content-length", "0")
+    if not (value.isascii() and value.isdigit()):
+        raise _HTTPError(400, "The header 'Content-Length' expects a non-negative integer.")
+    return int(value)
+
+def _integer(parameters, key, default=None, minimum=None, maximum=None):
+    if key not in parameters:
+        return default
+    try:
+        value = int(parameters[key])
+    except ValueError:
+        raise _HTTPError(400, f"The parameter '{key}' expects an integer.")
+    _check_range(key, value, minimum, maximum)
+    return value
+
+def _number(parameters, key, default=None, minimum=None, maximum=None):
+    if key not in parameters:
+        return default
+    try:
+        value = float(parameters[key])
+    except ValueError:
+        raise _HTTPError(400, f"The parameter '{key}' expects a number.")
+    if not math.isfinite(value):
+        raise _HTTPError(400, f"The parameter '{key}' expects a finite number.")
+    _check_range(key, value, minimum, maximum)
+    return value
+
+def _check_range(key, value, minimum, maximum):
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise _HTTPError(400, f"The parameter '{key}' expects a value from {minimum if minimum is not None else '-inf'} to {maximum if maximum is not None else 'inf'}.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP service answering the questions of functions.py.")
+    parser.add_argument("--national", default=r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\NationalNames.csv", help="path to NationalNames.csv")
+    parser.add_argument("--state", default=r"C:\Users\matej\.cache\kagglehub\datasets\kaggle\us-baby-names\versions\2\StateNames.csv", help="path to StateNames.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--render-processes", type=int, default=None, help="number of processes rendering the PNG plots, by default one background thread")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random unisex names")
+    args = parser.parse_args()
+
+    print("Loading the datasets")
+    service = NamesService(args.national, args.state, args.render_processes, seed=args.seed)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()